@@ -1,5 +1,4 @@
-import json
-
+import serialization
 from flask import Flask, request
 
 app = Flask(__name__)
@@ -48,7 +47,7 @@ def invalid_url(e):
     """
     Checks if URL is valid.
     """
-    return json.dumps({"error": "URL is invalid"}), 400
+    return serialization.dumps({"error": "URL is invalid"}), 400
 
 
 @app.route("/api/posts/")
@@ -57,7 +56,7 @@ def get_posts():
     Returns all posts.
     """
     res = {"posts": list(posts.values())}
-    return json.dumps(res), 200
+    return serialization.dumps(res), 200
 
 
 @app.route("/api/posts/", methods=["POST"])
@@ -66,16 +65,16 @@ def create_post():
     Creates a new post.
     """
     global post_id_counter
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     title = body.get("title")
     link = body.get("link")
     username = body.get("username")
     if not title:
-        return json.dumps({"error": "User did not supply title"}), 400
+        return serialization.dumps({"error": "User did not supply title"}), 400
     if not link:
-        return json.dumps({"error": "User did not supply link"}), 400
+        return serialization.dumps({"error": "User did not supply link"}), 400
     if not username:
-        return json.dumps({"error": "User did not supply username"}), 400
+        return serialization.dumps({"error": "User did not supply username"}), 400
     post = {
         "id": post_id_counter,
         "upvotes": 1,
@@ -86,7 +85,7 @@ def create_post():
     posts[post_id_counter] = post
     comments[post_id_counter] = {}
     post_id_counter += 1
-    return json.dumps(post), 201
+    return serialization.dumps(post), 201
 
 
 @app.route("/api/posts/<int:post_id>/")
@@ -96,8 +95,8 @@ def get_post(post_id):
     """
     post = posts.get(post_id)
     if not post:
-        return json.dumps({"error": "Post not found"}), 404
-    return json.dumps(post), 200
+        return serialization.dumps({"error": "Post not found"}), 404
+    return serialization.dumps(post), 200
 
 
 @app.route("/api/posts/<int:post_id>/", methods=["DELETE"])
@@ -107,10 +106,10 @@ def delete_post(post_id):
     """
     post = posts.get(post_id)
     if not post:
-        return json.dumps({"error": "Post not found"}), 404
+        return serialization.dumps({"error": "Post not found"}), 404
     del posts[post_id]
     del comments[post_id]
-    return json.dumps(post), 200
+    return serialization.dumps(post), 200
 
 
 @app.route("/api/posts/<int:post_id>/comments/")
@@ -120,8 +119,8 @@ def get_comments(post_id):
     """
     res = comments.get(post_id)
     if res is None:
-        return json.dumps({"error": "Post not found"}), 404
-    return json.dumps({"comments": list(res.values())}), 200
+        return serialization.dumps({"error": "Post not found"}), 404
+    return serialization.dumps({"comments": list(res.values())}), 200
 
 
 @app.route("/api/posts/<int:post_id>/comments/", methods=["POST"])
@@ -130,13 +129,13 @@ def create_comment(post_id):
     Creates a new comment for a post given its ID.
     """
     global comment_id_counter
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     text = body.get("text")
     username = body.get("username")
     if not text:
-        return json.dumps({"error": "User did not supply text"}), 400
+        return serialization.dumps({"error": "User did not supply text"}), 400
     if not username:
-        return json.dumps({"error": "User did not supply username"}), 400
+        return serialization.dumps({"error": "User did not supply username"}), 400
     comment = {
         "id": comment_id_counter,
         "upvotes": 1,
@@ -145,10 +144,10 @@ def create_comment(post_id):
     }
     dct = comments.get(post_id)
     if dct is None:
-        return json.dumps({"error": "Post not found"}), 404
+        return serialization.dumps({"error": "Post not found"}), 404
     dct[comment_id_counter] = comment
     comment_id_counter += 1
-    return json.dumps(comment), 201
+    return serialization.dumps(comment), 201
 
 
 @app.route("/api/posts/<int:post_id>/comments/<int:comment_id>/", methods=["POST"])
@@ -158,16 +157,16 @@ def edit_comment(post_id, comment_id):
     """
     cmts = comments.get(post_id)
     if cmts is None:
-        return json.dumps({"error": "Post not found"}), 404
+        return serialization.dumps({"error": "Post not found"}), 404
     comment = cmts.get(comment_id)
     if not comment:
-        return json.dumps({"error": "Comment not found"}), 404
-    body = json.loads(request.data)
+        return serialization.dumps({"error": "Comment not found"}), 404
+    body = serialization.loads(request.data)
     text = body.get("text")
     if not text:
-        return json.dumps({"error": "User did not supply text"}), 400
+        return serialization.dumps({"error": "User did not supply text"}), 400
     comment["text"] = text
-    return json.dumps(comment), 200
+    return serialization.dumps(comment), 200
 
 
 # OPTIONAL CHALLENGES
@@ -180,22 +179,22 @@ def create_post_extra():
     Creates a new post while checking preconditions.
     """
     global post_id_counter
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     title = body.get("title")
     link = body.get("link")
     username = body.get("username")
     if not title:
-        return json.dumps({"error": "User did not supply title"}), 400
+        return serialization.dumps({"error": "User did not supply title"}), 400
     if not link:
-        return json.dumps({"error": "User did not supply link"}), 400
+        return serialization.dumps({"error": "User did not supply link"}), 400
     if not username:
-        return json.dumps({"error": "User did not supply username"}), 400
+        return serialization.dumps({"error": "User did not supply username"}), 400
     if not isinstance(title, str):
-        return json.dumps({"error": "Title must be a string"}), 400
+        return serialization.dumps({"error": "Title must be a string"}), 400
     if not isinstance(link, str):
-        return json.dumps({"error": "Link must be a string"}), 400
+        return serialization.dumps({"error": "Link must be a string"}), 400
     if not isinstance(username, str):
-        return json.dumps({"error": "Username must be a string"}), 400
+        return serialization.dumps({"error": "Username must be a string"}), 400
     post = {
         "id": post_id_counter,
         "upvotes": 1,
@@ -206,7 +205,7 @@ def create_post_extra():
     posts[post_id_counter] = post
     comments[post_id_counter] = {}
     post_id_counter += 1
-    return json.dumps(post), 201
+    return serialization.dumps(post), 201
 
 
 @app.route("/api/extra/posts/<int:post_id>/comments/", methods=["POST"])
@@ -215,17 +214,17 @@ def create_comment_extra(post_id):
     Creates a new comment for a post given its ID while checking preconditions.
     """
     global comment_id_counter
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     text = body.get("text")
     username = body.get("username")
     if not text:
-        return json.dumps({"error": "User did not supply text"}), 400
+        return serialization.dumps({"error": "User did not supply text"}), 400
     if not username:
-        return json.dumps({"error": "User did not supply username"}), 400
+        return serialization.dumps({"error": "User did not supply username"}), 400
     if not isinstance(text, str):
-        return json.dumps({"error": "Text must be a string"}), 400
+        return serialization.dumps({"error": "Text must be a string"}), 400
     if not isinstance(username, str):
-        return json.dumps({"error": "Username must be a string"}), 400
+        return serialization.dumps({"error": "Username must be a string"}), 400
     comment = {
         "id": comment_id_counter,
         "upvotes": 1,
@@ -234,10 +233,10 @@ def create_comment_extra(post_id):
     }
     dct = comments.get(post_id)
     if dct is None:
-        return json.dumps({"error": "Post not found"}), 404
+        return serialization.dumps({"error": "Post not found"}), 404
     dct[comment_id_counter] = comment
     comment_id_counter += 1
-    return json.dumps(comment), 201
+    return serialization.dumps(comment), 201
 
 
 @app.route(
@@ -249,18 +248,18 @@ def edit_comment_extra(post_id, comment_id):
     """
     cmts = comments.get(post_id)
     if cmts is None:
-        return json.dumps({"error": "Post not found"}), 404
+        return serialization.dumps({"error": "Post not found"}), 404
     comment = cmts.get(comment_id)
     if not comment:
-        return json.dumps({"error": "Comment not found"}), 404
-    body = json.loads(request.data)
+        return serialization.dumps({"error": "Comment not found"}), 404
+    body = serialization.loads(request.data)
     text = body.get("text")
     if not text:
-        return json.dumps({"error": "User did not supply text"}), 400
+        return serialization.dumps({"error": "User did not supply text"}), 400
     if not isinstance(text, str):
-        return json.dumps({"error": "Text must be a string"}), 400
+        return serialization.dumps({"error": "Text must be a string"}), 400
     comment["text"] = text
-    return json.dumps(comment), 200
+    return serialization.dumps(comment), 200
 
 
 # TASK 2
@@ -273,16 +272,16 @@ def increment_upvotes(post_id):
     """
     post = posts.get(post_id)
     if not post:
-        return json.dumps({"error": "Post not found"}), 404
+        return serialization.dumps({"error": "Post not found"}), 404
     if not request.data:
         post["upvotes"] += 1
     else:
-        body = json.loads(request.data)
+        body = serialization.loads(request.data)
         amt = body.get("upvotes")
         if not isinstance(amt, int):
-            return json.dumps({"error": "Upvotes must be an integer"}), 400
+            return serialization.dumps({"error": "Upvotes must be an integer"}), 400
         post["upvotes"] += amt
-    return json.dumps(post), 200
+    return serialization.dumps(post), 200
 
 
 @app.route("/api/extra/posts/")
@@ -299,7 +298,7 @@ def get_posts_sorted():
             lst.sort(key=lambda post: post["upvotes"])
         else:
             lst.sort(key=lambda post: post["upvotes"], reverse=True)
-        return json.dumps({"posts": lst}), 200
+        return serialization.dumps({"posts": lst}), 200
 
 
 if __name__ == "__main__":
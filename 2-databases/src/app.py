@@ -1,26 +1,27 @@
 import hashlib
-import json
 import os
 
 import db
+import serialization
 from flask import Flask, request
 
 app = Flask(__name__)
 DB = db.DatabaseDriver()
+DB.init_app(app)
 
 
 def success_response(body, code=200):
     """
     Dumps the given body as json and returns code 200 if one isn't given.
     """
-    return json.dumps(body), code
+    return serialization.dumps(body), code
 
 
 def failure_response(message, code=404):
     """
     Dumps the error message and returns code 404 is one isn't given.
     """
-    return json.dumps({"error": message}), code
+    return serialization.dumps({"error": message}), code
 
 
 @app.route("/")
@@ -37,7 +38,7 @@ def create_user():
     """
     Creates a new user given a name, username, and optional balance.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     name = body.get("name")
     username = body.get("username")
     balance = body.get("balance", 0)
@@ -84,7 +85,7 @@ def send_money():
     """
     Sends the specified amount of money from one user to another.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     sender_id = body.get("sender_id")
     receiver_id = body.get("receiver_id")
     amount = body.get("amount")
@@ -106,15 +107,55 @@ def send_money():
             ),
             400,
         )
+    if not db.is_valid_amount(amount):
+        return failure_response("Amount must be a positive integer.", 400)
 
-    sender = DB.get_user_by_id(sender_id)
-    if sender["balance"] < amount:
-        return failure_response("Sender does not have enough balance", 400)
-
-    DB.send_money_to_user(sender_id, receiver_id, amount)
+    if not DB.send_money_to_user(sender_id, receiver_id, amount):
+        return send_failure_response(sender_id, receiver_id)
     return success_response(body)
 
 
+@app.route("/api/send/batch/", methods=["POST"])
+def send_money_batch():
+    """
+    Sends money for each of the given transfers, committing them all at once.
+    """
+    body = serialization.loads(request.data)
+    transfers = body.get("transfers")
+    if not isinstance(transfers, list):
+        return failure_response("Transfers were not provided.", 400)
+
+    fields = ["sender_id", "receiver_id", "amount"]
+    if any(
+        not isinstance(t, dict) or any(t.get(field) is None for field in fields)
+        for t in transfers
+    ):
+        return failure_response(
+            "Each transfer needs a sender_id, receiver_id and amount.", 400
+        )
+    if not all(db.is_valid_amount(t["amount"]) for t in transfers):
+        return failure_response("Each amount must be a positive integer.", 400)
+
+    results = DB.send_money_batch([[t[field] for field in fields] for t in transfers])
+    return success_response(
+        {
+            "transfers": [
+                {**transfer, "success": success}
+                for transfer, success in zip(transfers, results)
+            ]
+        }
+    )
+
+
+def send_failure_response(sender_id, receiver_id):
+    """
+    Returns the reason a transfer between the given users did not go through.
+    """
+    if DB.get_user_by_id(sender_id) is None or DB.get_user_by_id(receiver_id) is None:
+        return failure_response("One or more users not found.")
+    return failure_response("Sender does not have enough balance", 400)
+
+
 # OPTIONAL TASKS
 # TASK 1
 @app.route("/api/extra/users/", methods=["POST"])
@@ -122,7 +163,7 @@ def create_user_w_password():
     """
     Creates a new user given a name, username, password, and optional balance.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     name = body.get("name")
     username = body.get("username")
     balance = body.get("balance", 0)
@@ -150,7 +191,7 @@ def get_user_w_password(user_id):
     """
     Returns the user specified by the given id if correct password is given.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     password = body.get("password")
 
     if password is None:
@@ -170,7 +211,7 @@ def send_money_w_password():
     """
     Sends the specified amount of money from one user to another. Requires sender's password.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     sender_id = body.get("sender_id")
     receiver_id = body.get("receiver_id")
     amount = body.get("amount")
@@ -194,6 +235,9 @@ def send_money_w_password():
             400,
         )
 
+    if not db.is_valid_amount(amount):
+        return failure_response("Amount must be a positive integer.", 400)
+
     if password is None:
         return failure_response("Sender password must be provided.", 401)
 
@@ -201,11 +245,8 @@ def send_money_w_password():
     if hash_password_salt(password) != DB.get_user_password(sender_id)["password"]:
         return failure_response("Incorrect password.", 401)
 
-    sender = DB.get_user_by_id(sender_id)
-    if sender["balance"] < amount:
-        return failure_response("Sender does not have enough balance", 400)
-
-    DB.send_money_to_user(sender_id, receiver_id, amount)
+    if not DB.send_money_to_user(sender_id, receiver_id, amount):
+        return send_failure_response(sender_id, receiver_id)
     return success_response(body)
 
 
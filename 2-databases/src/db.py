@@ -1,16 +1,18 @@
+import os
 import sqlite3
+import threading
 
+DB_FILENAME = "venmo.db"
+# prepared statements kept per connection, enough for every query the driver
+# runs so none is parsed twice
+CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", 256))
 
-# From: https://goo.gl/YzypOI
-def singleton(cls):
-    instances = {}
 
-    def getinstance():
-        if cls not in instances:
-            instances[cls] = cls()
-        return instances[cls]
-
-    return getinstance
+def is_valid_amount(amount):
+    """
+    Returns whether amount can be transferred, i.e. is a positive integer.
+    """
+    return isinstance(amount, int) and not isinstance(amount, bool) and amount > 0
 
 
 class DatabaseDriver:
@@ -20,9 +22,75 @@ class DatabaseDriver:
     """
 
     def __init__(self):
-        self.conn = sqlite3.connect("venmo.db", check_same_thread=False)
+        self.local = threading.local()
+        # connections held when the process forks, kept referenced in the child
+        # so they aren't closed out from under the parent
+        self.inherited = []
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def init_app(self, app):
+        """
+        Creates the tables on a connection that is closed afterwards, so none
+        is open if the server forks workers, and registers the driver's
+        teardown with app. Each thread of each worker opens its own connection
+        on first use.
+        """
         self.create_user_table()
         self.create_password_table()
+        self.close()
+        app.teardown_appcontext(self.teardown)
+
+    @property
+    def conn(self):
+        """
+        Returns the calling thread's connection to the database, opening one if
+        needed. WAL mode lets readers on other threads run alongside a writer.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                DB_FILENAME, timeout=10, cached_statements=CACHED_STATEMENTS
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            self.local.conn = conn
+        return conn
+
+    def warm_up(self):
+        """
+        Opens the calling thread's connection and loads the schema ahead of its
+        first request.
+        """
+        self.conn.execute("SELECT 1 FROM user LIMIT 1;")
+
+    def after_fork(self):
+        """
+        Drops the connections inherited from the parent process, which can't be
+        shared across processes, and warms up one of the child's own.
+        """
+        self.inherited.append(self.local)
+        self.local = threading.local()
+        try:
+            self.warm_up()
+        except Exception as e:
+            print(e)
+
+    def teardown(self, exception):
+        """
+        Rolls back any transaction a request left open on the calling thread's
+        connection, so it can't hold the database lock into the next request.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+
+    def close(self):
+        """
+        Closes the calling thread's connection, if it has one.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
 
     def create_user_table(self):
         try:
@@ -78,15 +146,45 @@ class DatabaseDriver:
 
     def send_money_to_user(self, sender_id, receiver_id, amount):
         """
-        Increments the balance of the specified user in the db.
+        Moves amount from the sender's balance to the receiver's in one
+        transaction. Returns False without changing either balance if the
+        sender doesn't have enough balance or either user doesn't exist.
         """
-        self.conn.execute(
-            "UPDATE user SET balance = balance - ? WHERE id = ?;", (amount, sender_id)
-        )
-        self.conn.execute(
-            "UPDATE user SET balance = balance + ? WHERE id = ?;", (amount, receiver_id)
+        return self.send_money_batch([(sender_id, receiver_id, amount)])[0]
+
+    def send_money_batch(self, transfers):
+        """
+        Applies each (sender_id, receiver_id, amount) transfer in a single
+        transaction and commit. Returns whether each transfer went through.
+        """
+        with self.conn:
+            # take the write lock up front so balance checks can't race
+            self.conn.execute("BEGIN IMMEDIATE;")
+            return [self._apply_transfer(*transfer) for transfer in transfers]
+
+    def _apply_transfer(self, sender_id, receiver_id, amount):
+        """
+        Moves amount from the sender to the receiver within the current
+        transaction if the sender has enough balance. Raises ValueError,
+        rolling back the whole transaction, if amount isn't a positive integer.
+        """
+        if not is_valid_amount(amount):
+            raise ValueError(f"Invalid transfer amount: {amount!r}")
+        self.conn.execute("SAVEPOINT transfer;")
+        sent = self.conn.execute(
+            "UPDATE user SET balance = balance - ? WHERE id = ? AND balance >= ?;",
+            (amount, sender_id, amount),
+        ).rowcount
+        received = sent and (
+            self.conn.execute(
+                "UPDATE user SET balance = balance + ? WHERE id = ?;",
+                (amount, receiver_id),
+            ).rowcount
         )
-        self.conn.commit()
+        if not received:
+            self.conn.execute("ROLLBACK TO transfer;")
+        self.conn.execute("RELEASE transfer;")
+        return bool(received)
 
     # OPTIONAL TASKS
     # TASK 1
@@ -128,8 +226,3 @@ class DatabaseDriver:
         for row in cursor:
             return {"user_id": row[0], "password": row[1]}
         return None
-
-
-# Only <=1 instance of the database driver
-# exists within the app at all times
-DatabaseDriver = singleton(DatabaseDriver)
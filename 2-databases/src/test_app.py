@@ -0,0 +1,70 @@
+"""
+Tests for the Venmo app, run with pytest from this directory
+"""
+
+import json
+import os
+import tempfile
+
+import db
+
+db.DB_FILENAME = os.path.join(tempfile.mkdtemp(), "test_venmo.db")
+
+import pytest
+from app import DB, app
+
+
+@pytest.fixture
+def client():
+    """
+    Returns a test client for a database holding two users, each with a
+    balance of 10
+    """
+    DB.conn.execute("DELETE FROM password;")
+    DB.conn.execute("DELETE FROM user;")
+    DB.conn.commit()
+    DB.insert_user("Alice", "alice", 10, "password")
+    DB.insert_user("Bob", "bob", 10, "password")
+    return app.test_client()
+
+
+def get_balances():
+    """
+    Returns the balance of every user
+    """
+    return [DB.get_user_by_id(user["id"])["balance"] for user in DB.get_all_users()]
+
+
+def test_batch_rejects_invalid_transfers(client):
+    """
+    Batches with negative amounts or malformed transfers move no money
+    """
+    alice, bob = [user["id"] for user in DB.get_all_users()]
+    for transfers in [
+        [{"sender_id": alice, "receiver_id": bob, "amount": -50}],
+        [{"sender_id": alice, "receiver_id": bob, "amount": 5}, [alice, bob, 5]],
+    ]:
+        response = client.post(
+            "/api/send/batch/", data=json.dumps({"transfers": transfers})
+        )
+        assert response.status_code == 400
+    with pytest.raises(ValueError):
+        DB.send_money_batch([(alice, bob, 5), (bob, alice, -50)])
+    assert get_balances() == [10, 10]
+
+
+def test_batch_applies_transfers_it_can_afford(client):
+    """
+    Each transfer in a batch goes through only if its sender can afford it
+    """
+    alice, bob = [user["id"] for user in DB.get_all_users()]
+    transfers = [
+        {"sender_id": alice, "receiver_id": bob, "amount": 8},
+        {"sender_id": alice, "receiver_id": bob, "amount": 8},
+    ]
+    response = client.post(
+        "/api/send/batch/", data=json.dumps({"transfers": transfers})
+    )
+    results = json.loads(response.data)["transfers"]
+    assert [t["success"] for t in results] == [True, False]
+    assert get_balances() == [2, 18]
@@ -1,29 +1,43 @@
-import json
-import os
 from datetime import datetime
 from sqlite3 import IntegrityError
 
 import db
-import sendgrid
+import notifications
+import serialization
 from flask import Flask, request
-from sendgrid.helpers.mail import Content, Email, Mail, To
 
 app = Flask(__name__)
 DB = db.DatabaseDriver()
+DB.init_app(app)
+WORKER = notifications.NotificationWorker(DB, notifications.get_sender())
+
+
+@app.before_request
+def start_worker():
+    """
+    Starts the notification worker once the process serves its first request,
+    so emails still queued from before a restart go out. Each serving process
+    runs its own worker; workers claim emails so each is sent once.
+    """
+    WORKER.ensure_running()
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
 
 def success_response(body, code=200):
     """
     Dumps the given body as json and returns code 200 if one isn't given.
     """
-    return json.dumps(body), code
+    return serialization.dumps(body), code
 
 
 def failure_response(message, code=404):
     """
     Dumps the error message and returns code 404 is one isn't given.
     """
-    return json.dumps({"error": message}), code
+    return serialization.dumps({"error": message}), code
 
 
 @app.route("/")
@@ -40,7 +54,7 @@ def create_user():
     """
     Creates a new user given a name, username, and optional balance.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     name = body.get("name")
     username = body.get("username")
     balance = body.get("balance", 0)
@@ -54,7 +68,7 @@ def create_user():
         return failure_response("Username was not provided.", 400)
 
     user_id = DB.insert_user(name, username, balance, email)
-    user = DB.get_user_by_id(user_id)
+    user = get_user_with_transactions(user_id)
     if user is None:
         return failure_response("Something went wrong while creating the user!", 500)
     return success_response(user, 201)
@@ -65,7 +79,7 @@ def get_user(user_id):
     """
     Returns the user specified by the given id.
     """
-    user = DB.get_user_by_id(user_id)
+    user = get_user_with_transactions(user_id)
     if user is None:
         return failure_response("User not found.")
     return success_response(user)
@@ -76,19 +90,66 @@ def delete_user(user_id):
     """
     Deletes the user specified by the given id.
     """
-    user = DB.get_user_by_id(user_id)
+    user = get_user_with_transactions(user_id)
     if user is None:
         return failure_response("User not found.")
     DB.delete_user_by_id(user_id)
     return success_response(user)
 
 
+def get_next_cursor(transactions, limit):
+    """
+    Returns the cursor of the page after the given page of transactions, which
+    is None if this is the last page.
+    """
+    return transactions[-1]["id"] if len(transactions) == limit else None
+
+
+def get_user_with_transactions(user_id):
+    """
+    Returns the user specified by the given id with the first page of their
+    transactions and the cursor of the next page, or None if there's no such
+    user.
+    """
+    user = DB.get_simple_user_by_id(user_id)
+    if user is not None:
+        transactions = DB.get_transactions_page_by_user(user_id, DEFAULT_PAGE_SIZE)
+        user["transactions"] = transactions
+        user["transactions_next_cursor"] = get_next_cursor(
+            transactions, DEFAULT_PAGE_SIZE
+        )
+    return user
+
+
+@app.route("/api/users/<int:user_id>/transactions/")
+def get_user_transactions(user_id):
+    """
+    Returns a page of the user's transactions, most recently created first.
+    The page size and starting point are given by the limit and after
+    (transaction id) params.
+    """
+    user = DB.get_simple_user_by_id(user_id)
+    if user is None:
+        return failure_response("User not found.")
+
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = request.args.get("after", type=int)
+    transactions = DB.get_transactions_page_by_user(user_id, limit, after)
+    return success_response(
+        {
+            "transactions": transactions,
+            "next_cursor": get_next_cursor(transactions, limit),
+        }
+    )
+
+
 @app.route("/api/transactions/", methods=["POST"])
 def create_transaction():
     """
     Creates a new transaction with given info.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     sender_id = body.get("sender_id")
     receiver_id = body.get("receiver_id")
     amount = body.get("amount")
@@ -115,30 +176,47 @@ def create_transaction():
             400,
         )
 
+    if not db.is_valid_amount(amount):
+        return failure_response("Amount must be a positive integer.", 400)
+
     time = str(datetime.now())
-    try:
-        transaction = {
-            "id": DB.insert_transaction(
+    if accepted:
+        # the transaction is only recorded if the money actually moves
+        transaction_id = DB.insert_sent_transaction(
+            time, sender_id, receiver_id, amount, message, transfer_emails
+        )
+        if transaction_id is None:
+            return send_failure_response(sender_id, receiver_id)
+    else:
+        try:
+            transaction_id = DB.insert_transaction(
                 time, sender_id, receiver_id, amount, message, accepted
-            ),
-            "timestamp": time,
-            "sender_id": sender_id,
-            "receiver_id": receiver_id,
-            "amount": amount,
-            "message": message,
-            "accepted": accepted,
-        }
-        if accepted:
-            sender = DB.get_user_by_id(sender_id)
-            if sender["balance"] < amount:
-                return failure_response("Sender does not have enough balance", 403)
-            DB.send_money_to_user(sender_id, receiver_id, amount)
-            send_email(
-                amount, DB.get_user_by_id(sender_id), DB.get_user_by_id(receiver_id)
             )
-        return success_response(transaction, 201)
-    except IntegrityError:
+        except IntegrityError:
+            return failure_response("One or more users not found.")
+
+    transaction = {
+        "id": transaction_id,
+        "timestamp": time,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "amount": amount,
+        "message": message,
+        "accepted": accepted,
+    }
+    return success_response(transaction, 201)
+
+
+def send_failure_response(sender_id, receiver_id):
+    """
+    Returns the reason a transfer between the given users did not go through.
+    """
+    if (
+        DB.get_simple_user_by_id(sender_id) is None
+        or DB.get_simple_user_by_id(receiver_id) is None
+    ):
         return failure_response("One or more users not found.")
+    return failure_response("Sender does not have enough balance", 403)
 
 
 @app.route("/api/transactions/<int:transaction_id>/", methods=["POST"])
@@ -146,7 +224,7 @@ def accept_or_deny_request(transaction_id):
     """
     Accepts or denys a payment requestion of the given transaction id.
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     accepted = body.get("accepted")
 
     if accepted is None:
@@ -159,20 +237,12 @@ def accept_or_deny_request(transaction_id):
     if transaction["accepted"] is None:
         time = str(datetime.now())
         if accepted:
-            sender = DB.get_user_by_id(transaction["sender_id"])
-            if sender["balance"] < transaction["amount"]:
+            try:
+                sent = DB.accept_transaction(transaction_id, time, transfer_emails)
+            except ValueError:
+                return failure_response("Amount must be a positive integer.", 400)
+            if not sent:
                 return failure_response("Sender does not have enough balance", 403)
-            DB.send_money_to_user(
-                transaction["sender_id"],
-                transaction["receiver_id"],
-                transaction["amount"],
-            )
-            DB.update_transaction_by_id(transaction_id, time, True)
-            send_email(
-                transaction["amount"],
-                DB.get_user_by_id(transaction["sender_id"]),
-                DB.get_user_by_id(transaction["receiver_id"]),
-            )
         else:
             DB.update_transaction_by_id(transaction_id, time, False)
     else:
@@ -191,7 +261,7 @@ def get_friends(user_id):
     """
     Returns the user's friends.
     """
-    user = DB.get_user_by_id(user_id)
+    user = DB.get_simple_user_by_id(user_id)
     if user is None:
         return failure_response("User not found.")
     return success_response({"friends": DB.get_friends_by_user(user_id)})
@@ -212,50 +282,38 @@ def get_join_transactions(id):
     """
     Returns the transactions of the given user.
     """
-    user = DB.get_user_by_id(id)
+    user = DB.get_simple_user_by_id(id)
     if user is None:
         return failure_response("User not found.")
     return success_response({"transactions": DB.join_query(id)})
 
 
 # TASK 3
-def send_email(amount, sender, receiver):
-    receiver_sbj = "You've Received Money!"
-    receiver_cnt = Content(
-        "text/plain",
-        f"You've received ${amount} from {sender.get('name')}! Your balance is now ${receiver.get('balance')}.",
-    )
-
-    sender_sbj = "You've Sent Money!"
-    sender_cnt = Content(
-        "text/plain",
-        f"You've sent ${amount} to {receiver.get('name')}! Your balance is now ${sender.get('balance')}.",
-    )
-
-    fail_msg = []
-
+def transfer_emails(amount, sender, receiver):
+    """
+    Returns the (email, subject, content) emails telling the sender and
+    receiver about a transaction. The driver queues them in the transfer's own
+    transaction, and the notification worker sends them in the background.
+    """
+    emails = []
     if (r_email := receiver.get("email")) is not None:
-        sg = sendgrid.SendGridAPIClient(api_key=os.environ.get("SENDGRID_API_KEY"))
-        from_email = Email(os.environ.get("FROM_EMAIL"))
-        to_email = To(r_email)
-        mail = Mail(from_email, to_email, receiver_sbj, receiver_cnt)
-        response = sg.client.mail.send.post(request_body=mail.get())
-        if response.status_code != 201:
-            fail_msg.append("receiver")
+        emails.append(
+            (
+                r_email,
+                "You've Received Money!",
+                f"You've received ${amount} from {sender.get('name')}! Your balance is now ${receiver.get('balance')}.",
+            )
+        )
 
     if (s_email := sender.get("email")) is not None:
-        sg = sendgrid.SendGridAPIClient(api_key=os.environ.get("SENDGRID_API_KEY"))
-        from_email = Email(os.environ.get("FROM_EMAIL"))
-        to_email = To(s_email)
-        mail = Mail(from_email, to_email, sender_sbj, sender_cnt)
-        response = sg.client.mail.send.post(request_body=mail.get())
-        if response.status_code != 201:
-            fail_msg.append("sender")
-
-    if fail_msg:
-        return failure_response(f"Unable to send email to {'and'.join(fail_msg)}.")
-
-    return success_response("Emails sent.", 201)
+        emails.append(
+            (
+                s_email,
+                "You've Sent Money!",
+                f"You've sent ${amount} to {receiver.get('name')}! Your balance is now ${sender.get('balance')}.",
+            )
+        )
+    return emails
 
 
 # DEPRECATED
@@ -264,7 +322,7 @@ def send_email(amount, sender, receiver):
 #    """
 #    Sends the specified amount of money from one user to another.
 #    """
-#    body = json.loads(request.data)
+#    body = serialization.loads(request.data)
 #    sender_id = body.get("sender_id")
 #    receiver_id = body.get("receiver_id")
 #    amount = body.get("amount")
@@ -0,0 +1,32 @@
+"""
+Shared pytest setup, pointing the app at a throwaway database
+"""
+
+import os
+import tempfile
+
+os.environ["EMAIL_BACKEND"] = "console"
+
+import db
+
+db.DB_FILENAME = os.path.join(tempfile.mkdtemp(), "test_venmo.db")
+
+import pytest
+from app import DB, WORKER
+
+# tests drive notification workers themselves
+WORKER.stop()
+
+
+@pytest.fixture
+def database():
+    """
+    Returns the driver for a database holding two users, each with a balance
+    of 10
+    """
+    for table in ["transactions", "friend", "notification", "user"]:
+        DB.conn.execute(f"DELETE FROM {table};")
+    DB.conn.commit()
+    DB.insert_user("Alice", "alice", 10, "alice@example.com")
+    DB.insert_user("Bob", "bob", 10, "bob@example.com")
+    return DB
@@ -1,16 +1,19 @@
+import os
 import sqlite3
+import threading
+import time
 
+DB_FILENAME = "venmo.db"
+# prepared statements kept per connection, enough for every query the driver
+# runs so none is parsed twice
+CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", 256))
 
-# From: https://goo.gl/YzypOI
-def singleton(cls):
-    instances = {}
 
-    def getinstance():
-        if cls not in instances:
-            instances[cls] = cls()
-        return instances[cls]
-
-    return getinstance
+def is_valid_amount(amount):
+    """
+    Returns whether amount can be transferred, i.e. is a positive integer.
+    """
+    return isinstance(amount, int) and not isinstance(amount, bool) and amount > 0
 
 
 class DatabaseDriver:
@@ -20,11 +23,79 @@ class DatabaseDriver:
     """
 
     def __init__(self):
-        self.conn = sqlite3.connect("venmo.db", check_same_thread=False)
-        self.conn.execute("PRAGMA foreign_keys = 1")
+        self.local = threading.local()
+        # connections held when the process forks, kept referenced in the child
+        # so they aren't closed out from under the parent
+        self.inherited = []
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def init_app(self, app):
+        """
+        Creates the tables on a connection that is closed afterwards, so none
+        is open if the server forks workers, and registers the driver's
+        teardown with app. Each thread of each worker opens its own connection
+        on first use.
+        """
         self.create_user_table()
         self.create_transactions_table()
         self.create_friend_table()
+        self.create_notification_table()
+        self.create_indexes()
+        self.close()
+        app.teardown_appcontext(self.teardown)
+
+    @property
+    def conn(self):
+        """
+        Returns the calling thread's connection to the database, opening one if
+        needed. WAL mode lets readers on other threads run alongside a writer.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                DB_FILENAME, timeout=10, cached_statements=CACHED_STATEMENTS
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA foreign_keys = 1")
+            self.local.conn = conn
+        return conn
+
+    def warm_up(self):
+        """
+        Opens the calling thread's connection and loads the schema ahead of its
+        first request.
+        """
+        self.conn.execute("SELECT 1 FROM user LIMIT 1;")
+
+    def after_fork(self):
+        """
+        Drops the connections inherited from the parent process, which can't be
+        shared across processes, and warms up one of the child's own.
+        """
+        self.inherited.append(self.local)
+        self.local = threading.local()
+        try:
+            self.warm_up()
+        except Exception as e:
+            print(e)
+
+    def teardown(self, exception):
+        """
+        Rolls back any transaction a request left open on the calling thread's
+        connection, so it can't hold the database lock into the next request.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+
+    def close(self):
+        """
+        Closes the calling thread's connection, if it has one.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
 
     def create_user_table(self):
         try:
@@ -62,6 +133,25 @@ class DatabaseDriver:
         except Exception as e:
             print(e)
 
+    def create_indexes(self):
+        """
+        Creates the indexes used to look up transactions and friends by user,
+        if they don't exist yet.
+        """
+        self.conn.executescript(
+            """
+            DROP INDEX IF EXISTS transactions_sender_id_timestamp;
+            DROP INDEX IF EXISTS transactions_receiver_id_timestamp;
+            CREATE INDEX IF NOT EXISTS transactions_sender_id
+                ON transactions(SENDER_ID, ID);
+            CREATE INDEX IF NOT EXISTS transactions_receiver_id
+                ON transactions(RECEIVER_ID, ID);
+            CREATE INDEX IF NOT EXISTS friend_user_id ON friend(USER_ID);
+            CREATE INDEX IF NOT EXISTS notification_next_attempt
+                ON notification(NEXT_ATTEMPT);
+            """
+        )
+
     def get_all_users(self):
         """
         Returns a list of all the users in the database.
@@ -102,27 +192,37 @@ class DatabaseDriver:
         """
         Returns the user specified by the given id.
         """
+        user = self.get_simple_user_by_id(id)
+        if user:
+            user["transactions"] = self.get_transactions_by_user(id)
+        return user
+
+    def get_simple_user_by_id(self, id):
+        """
+        Returns the user specified by the given id without their transactions.
+        """
         cursor = self.conn.execute("SELECT * FROM user WHERE id = ?;", (id,))
-        user = None
         for row in cursor:
-            user = {
+            return {
                 "id": row[0],
                 "name": row[1],
                 "username": row[2],
                 "balance": row[3],
                 "email": row[4],
             }
-
-        if user:
-            user["transactions"] = self.get_transactions_by_user(id)
-        return user
+        return None
 
     def get_transactions_by_user(self, user_id):
         """
         Returns all of the transactions of a user.
         """
         cursor = self.conn.execute(
-            "SELECT * FROM transactions WHERE sender_id = ? OR receiver_id = ?;",
+            """
+            SELECT * FROM transactions WHERE SENDER_ID = ?
+            UNION
+            SELECT * FROM transactions WHERE RECEIVER_ID = ?
+            ORDER BY ID;
+            """,
             (user_id, user_id),
         )
         transactions = []
@@ -140,6 +240,46 @@ class DatabaseDriver:
             )
         return transactions
 
+    def get_transactions_page_by_user(self, user_id, limit, after=None):
+        """
+        Returns up to limit of the user's transactions, most recently created
+        first, starting after the transaction with id after. Pages are keyed on
+        the id alone since accepting a transaction changes its timestamp.
+        """
+        cursor_filter, cursor_params = "", ()
+        if after is not None:
+            cursor_filter, cursor_params = "AND ID < ?", (after,)
+
+        # each side of the union reads at most limit rows off its index
+        side = f"""
+            SELECT * FROM (
+                SELECT * FROM transactions WHERE {{}} = ? {cursor_filter}
+                ORDER BY ID DESC LIMIT ?
+            )
+        """
+        side_params = (user_id, *cursor_params, limit)
+        cursor = self.conn.execute(
+            side.format("SENDER_ID")
+            + "UNION"
+            + side.format("RECEIVER_ID")
+            + "ORDER BY ID DESC LIMIT ?;",
+            (*side_params, *side_params, limit),
+        )
+        transactions = []
+        for row in cursor:
+            transactions.append(
+                {
+                    "id": row[0],
+                    "timestamp": row[1],
+                    "sender_id": row[2],
+                    "receiver_id": row[3],
+                    "amount": row[4],
+                    "message": row[5],
+                    "accepted": row[6],
+                }
+            )
+        return transactions
+
     def delete_user_by_id(self, id):
         """
         Deletes the specified user from the db.
@@ -160,15 +300,106 @@ class DatabaseDriver:
 
     def send_money_to_user(self, sender_id, receiver_id, amount):
         """
-        Increments the balance of the specified user in the db.
+        Moves amount from the sender's balance to the receiver's in one
+        transaction. Returns False without changing either balance if the
+        sender doesn't have enough balance or either user doesn't exist.
         """
-        self.conn.execute(
-            "UPDATE user SET balance = balance - ? WHERE id = ?;", (amount, sender_id)
+        return self.send_money_batch([(sender_id, receiver_id, amount)])[0]
+
+    def send_money_batch(self, transfers):
+        """
+        Applies each (sender_id, receiver_id, amount) transfer in a single
+        transaction and commit. Returns whether each transfer went through.
+        """
+        with self.conn:
+            # take the write lock up front so balance checks can't race
+            self.conn.execute("BEGIN IMMEDIATE;")
+            return [self._apply_transfer(*transfer) for transfer in transfers]
+
+    def _apply_transfer(self, sender_id, receiver_id, amount):
+        """
+        Moves amount from the sender to the receiver within the current
+        transaction if the sender has enough balance. Raises ValueError,
+        rolling back the whole transaction, if amount isn't a positive integer.
+        """
+        if not is_valid_amount(amount):
+            raise ValueError(f"Invalid transfer amount: {amount!r}")
+        self.conn.execute("SAVEPOINT transfer;")
+        sent = self.conn.execute(
+            "UPDATE user SET balance = balance - ? WHERE id = ? AND balance >= ?;",
+            (amount, sender_id, amount),
+        ).rowcount
+        received = sent and (
+            self.conn.execute(
+                "UPDATE user SET balance = balance + ? WHERE id = ?;",
+                (amount, receiver_id),
+            ).rowcount
         )
-        self.conn.execute(
-            "UPDATE user SET balance = balance + ? WHERE id = ?;", (amount, receiver_id)
+        if not received:
+            self.conn.execute("ROLLBACK TO transfer;")
+        self.conn.execute("RELEASE transfer;")
+        return bool(received)
+
+    def insert_sent_transaction(
+        self, timestamp, sender_id, receiver_id, amount, message, notify=None
+    ):
+        """
+        Inserts an accepted transaction, moves its amount from the sender to
+        the receiver and queues the emails built by notify in one transaction
+        and commit. Returns the transaction's id, or None without inserting it
+        if the transfer didn't go through.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE;")
+            if not self._apply_transfer(sender_id, receiver_id, amount):
+                return None
+            transaction_id = self.conn.execute(
+                "INSERT INTO transactions (TIMESTAMP, SENDER_ID, RECEIVER_ID, AMOUNT, MESSAGE, ACCEPTED) VALUES (?,?,?,?,?,?);",
+                (timestamp, sender_id, receiver_id, amount, message, True),
+            ).lastrowid
+            self._queue_notifications(notify, sender_id, receiver_id, amount)
+            return transaction_id
+
+    def accept_transaction(self, id, timestamp, notify=None):
+        """
+        Marks a pending transaction as accepted, moves its amount from the
+        sender to the receiver and queues the emails built by notify in one
+        transaction and commit. Returns False without changing anything if the
+        transaction isn't pending or the transfer didn't go through.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE;")
+            transaction = self.conn.execute(
+                "SELECT SENDER_ID, RECEIVER_ID, AMOUNT FROM transactions WHERE ID = ? AND ACCEPTED IS NULL;",
+                (id,),
+            ).fetchone()
+            if transaction is None or not self._apply_transfer(*transaction):
+                return False
+            self.conn.execute(
+                "UPDATE transactions SET TIMESTAMP = ?, ACCEPTED = ? WHERE ID = ?;",
+                (timestamp, True, id),
+            )
+            self._queue_notifications(notify, *transaction)
+            return True
+
+    def _queue_notifications(self, notify, sender_id, receiver_id, amount):
+        """
+        Queues the (email, subject, content) emails that notify builds from the
+        amount and the updated sender and receiver, as part of the caller's
+        transaction so they are only queued if the transfer commits.
+        """
+        if notify is None:
+            return
+        emails = notify(
+            amount,
+            self.get_simple_user_by_id(sender_id),
+            self.get_simple_user_by_id(receiver_id),
+        )
+        now = time.time()
+        self.conn.executemany(
+            "INSERT INTO notification (EMAIL, SUBJECT, CONTENT, NEXT_ATTEMPT) VALUES (?,?,?,?);",
+            [(email, subject, content, now) for email, subject, content in emails],
         )
-        self.conn.commit()
 
     def get_transaction_by_id(self, id):
         """
@@ -251,9 +482,13 @@ class DatabaseDriver:
         cursor = self.conn.execute(
             """
             SELECT S.NAME, R.NAME, T.AMOUNT, T.MESSAGE, T.ACCEPTED, T.TIMESTAMP
-            FROM transactions T, user S, user R
-            WHERE (T.SENDER_ID = ? OR T.RECEIVER_ID = ?)
-            AND T.SENDER_ID = S.ID AND T.RECEIVER_ID = R.ID;
+            FROM (
+                SELECT * FROM transactions WHERE SENDER_ID = ?
+                UNION
+                SELECT * FROM transactions WHERE RECEIVER_ID = ?
+            ) T, user S, user R
+            WHERE T.SENDER_ID = S.ID AND T.RECEIVER_ID = R.ID
+            ORDER BY T.ID;
             """,
             (id, id),
         )
@@ -271,7 +506,80 @@ class DatabaseDriver:
             )
         return transactions
 
+    # TASK 3
+    def create_notification_table(self):
+        try:
+            self.conn.execute(
+                """
+                CREATE TABLE notification (
+                    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                    EMAIL TEXT NOT NULL,
+                    SUBJECT TEXT NOT NULL,
+                    CONTENT TEXT NOT NULL,
+                    ATTEMPTS INTEGER NOT NULL DEFAULT 0,
+                    NEXT_ATTEMPT REAL NOT NULL
+                );
+                """
+            )
+        except Exception as e:
+            print(e)
+
+    def insert_notification(self, email, subject, content):
+        """
+        Queues an email with the given subject and content to be sent right away.
+        """
+        cursor = self.conn.execute(
+            "INSERT INTO notification (EMAIL, SUBJECT, CONTENT, NEXT_ATTEMPT) VALUES (?,?,?,?);",
+            (email, subject, content, time.time()),
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def claim_due_notifications(self, now, limit, lease):
+        """
+        Returns up to limit queued emails whose next attempt is due by now,
+        pushing their next attempt lease seconds out in the same transaction so
+        no other worker picks them up while they are being sent.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE;")
+            cursor = self.conn.execute(
+                "SELECT * FROM notification WHERE NEXT_ATTEMPT <= ? ORDER BY NEXT_ATTEMPT LIMIT ?;",
+                (now, limit),
+            )
+            notifications = []
+            for row in cursor:
+                notifications.append(
+                    {
+                        "id": row[0],
+                        "email": row[1],
+                        "subject": row[2],
+                        "content": row[3],
+                        "attempts": row[4],
+                    }
+                )
+            self.conn.executemany(
+                "UPDATE notification SET NEXT_ATTEMPT = ? WHERE ID = ?;",
+                [(now + lease, n["id"]) for n in notifications],
+            )
+        return notifications
 
-# Only <=1 instance of the database driver
-# exists within the app at all times
-DatabaseDriver = singleton(DatabaseDriver)
+    def reschedule_notification(self, id, next_attempt):
+        """
+        Records a failed attempt to send the specified email and schedules the
+        next one.
+        """
+        self.conn.execute(
+            "UPDATE notification SET ATTEMPTS = ATTEMPTS + 1, NEXT_ATTEMPT = ? WHERE ID = ?;",
+            (next_attempt, id),
+        )
+        self.conn.commit()
+
+    def delete_notifications(self, ids):
+        """
+        Removes the specified emails from the queue in a single commit.
+        """
+        self.conn.executemany(
+            "DELETE FROM notification WHERE ID = ?;", [(id,) for id in ids]
+        )
+        self.conn.commit()
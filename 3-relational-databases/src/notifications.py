@@ -0,0 +1,142 @@
+"""
+Notifications file
+
+Background worker that drains queued emails from the notification table in
+batches, retrying failed emails with exponential backoff
+"""
+
+import os
+import threading
+import time
+
+import sendgrid
+from sendgrid.helpers.mail import Content, Email, Mail, To
+
+BATCH_SIZE = 50
+POLL_INTERVAL = 1
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2
+# seconds a claimed notification is hidden from other workers; if its worker
+# dies before sending it, another one picks it up after this
+CLAIM_LEASE = 60
+
+
+class SendGridSender:
+    """
+    Sends emails through a single, reused SendGrid client
+    """
+
+    def __init__(self):
+        self.client = sendgrid.SendGridAPIClient(
+            api_key=os.environ.get("SENDGRID_API_KEY")
+        )
+        self.from_email = Email(os.environ.get("FROM_EMAIL"))
+
+    def send(self, email, subject, content):
+        """
+        Sends a plain text email and returns whether SendGrid accepted it
+        """
+        mail = Mail(self.from_email, To(email), subject, Content("text/plain", content))
+        response = self.client.client.mail.send.post(request_body=mail.get())
+        return 200 <= response.status_code < 300
+
+
+class ConsoleSender:
+    """
+    Prints emails instead of sending them, for local development and testing
+    """
+
+    def send(self, email, subject, content):
+        """
+        Prints the email and reports it as sent
+        """
+        print(f"To: {email}\nSubject: {subject}\n\n{content}\n")
+        return True
+
+
+def get_sender():
+    """
+    Returns the email sender chosen by the EMAIL_BACKEND environment variable
+    """
+    if os.environ.get("EMAIL_BACKEND") == "console":
+        return ConsoleSender()
+    return SendGridSender()
+
+
+class NotificationWorker(threading.Thread):
+    """
+    Daemon thread that sends queued notifications until stopped
+    """
+
+    def __init__(self, db, sender):
+        """
+        Initializes a worker that reads notifications from db and sends them
+        with sender
+        """
+        super().__init__(daemon=True)
+        self.db = db
+        self.sender = sender
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def ensure_running(self):
+        """
+        Starts the worker if it hasn't been started yet
+        """
+        with self.lock:
+            if not self.is_alive() and not self.stopped.is_set():
+                self.start()
+
+    def stop(self):
+        """
+        Stops the worker after its current batch
+        """
+        self.stopped.set()
+
+    def run(self):
+        """
+        Sends batches of due notifications, sleeping while there are none
+        """
+        while not self.stopped.is_set():
+            try:
+                sent = self.send_batch()
+            except Exception as e:
+                print(f"Error when sending notifications: {e}")
+                sent = 0
+            if not sent:
+                self.stopped.wait(POLL_INTERVAL)
+
+    def send_batch(self):
+        """
+        Sends up to BATCH_SIZE due notifications, deleting the ones that were
+        sent or ran out of attempts and rescheduling the rest
+
+        Returns the number of notifications processed
+        """
+        notifications = self.db.claim_due_notifications(
+            time.time(), BATCH_SIZE, CLAIM_LEASE
+        )
+        done = []
+        for notification in notifications:
+            try:
+                sent = self.sender.send(
+                    notification["email"],
+                    notification["subject"],
+                    notification["content"],
+                )
+            except Exception as e:
+                print(f"Error when sending email: {e}")
+                sent = False
+
+            attempts = notification["attempts"] + 1
+            if sent:
+                done.append(notification["id"])
+            elif attempts >= MAX_ATTEMPTS:
+                print(f"Giving up on email to {notification['email']}")
+                done.append(notification["id"])
+            else:
+                self.db.reschedule_notification(
+                    notification["id"], time.time() + BACKOFF_BASE**attempts
+                )
+        self.db.delete_notifications(done)
+        return len(notifications)
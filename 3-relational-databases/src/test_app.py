@@ -0,0 +1,173 @@
+"""
+Tests for the Venmo app, run with pytest from this directory
+"""
+
+import json
+
+import pytest
+from app import DB, app
+
+
+@pytest.fixture
+def client(database):
+    """
+    Returns a test client for a database holding two users
+    """
+    return app.test_client()
+
+
+def get_ids():
+    """
+    Returns the ids of the two users
+    """
+    return [user["id"] for user in DB.get_all_users()]
+
+
+def post(client, url, body):
+    """
+    Returns the status code and JSON body of a POST of body to url
+    """
+    response = client.post(url, data=json.dumps(body))
+    return response.status_code, json.loads(response.data)
+
+
+@pytest.mark.parametrize("amount", [-5, 0, 1.5, True, "5"])
+def test_transfer_rejects_invalid_amounts(client, amount):
+    """
+    Transfers that aren't positive integers are refused and move no money
+    """
+    alice, bob = get_ids()
+    with pytest.raises(ValueError):
+        DB.send_money_batch([(alice, bob, 5), (alice, bob, amount)])
+    code, _ = post(
+        client,
+        "/api/transactions/",
+        {"sender_id": alice, "receiver_id": bob, "amount": amount, "message": "hi"},
+    )
+    assert code == 400
+    assert DB.get_simple_user_by_id(alice)["balance"] == 10
+    assert DB.get_simple_user_by_id(bob)["balance"] == 10
+
+
+def test_rejected_payment_is_not_recorded(client):
+    """
+    A payment the sender can't afford leaves no transaction behind
+    """
+    alice, bob = get_ids()
+    body = {"sender_id": alice, "receiver_id": bob, "message": "hi", "accepted": True}
+    code, _ = post(client, "/api/transactions/", {**body, "amount": 50})
+    assert code == 403
+    assert DB.get_transactions_by_user(alice) == []
+
+    code, transaction = post(client, "/api/transactions/", {**body, "amount": 4})
+    assert code == 201
+    assert DB.get_transaction_by_id(transaction["id"])["accepted"]
+    assert DB.get_simple_user_by_id(bob)["balance"] == 14
+
+
+def test_accepting_a_request_moves_money_once(client):
+    """
+    A payment request is accepted in one step and can't be accepted twice
+    """
+    alice, bob = get_ids()
+    _, transaction = post(
+        client,
+        "/api/transactions/",
+        {"sender_id": alice, "receiver_id": bob, "amount": 6, "message": "hi"},
+    )
+    url = f"/api/transactions/{transaction['id']}/"
+    assert post(client, url, {"accepted": True})[0] == 200
+    assert post(client, url, {"accepted": True})[0] == 403
+    assert DB.get_simple_user_by_id(alice)["balance"] == 4
+    assert DB.get_simple_user_by_id(bob)["balance"] == 16
+
+
+def add_requests(sender_id, receiver_id, count):
+    """
+    Adds count pending payment requests of 1, oldest first, and returns their
+    ids
+    """
+    return [
+        DB.insert_transaction(
+            f"2020-01-01 00:00:{i:02}", sender_id, receiver_id, 1, "hi", None
+        )
+        for i in range(count)
+    ]
+
+
+def get(client, url):
+    """
+    Returns the JSON body of a GET of url
+    """
+    return json.loads(client.get(url).data)
+
+
+def test_transaction_pages_survive_accepts(client):
+    """
+    Accepting a transaction between page fetches doesn't repeat or skip rows
+    """
+    alice, bob = get_ids()
+    ids = add_requests(alice, bob, 6)
+    url = f"/api/users/{alice}/transactions/?limit=3"
+
+    page = get(client, url)
+    assert [t["id"] for t in page["transactions"]] == ids[:2:-1]
+
+    # the cursor's transaction gets a newer timestamp when accepted
+    assert post(client, f"/api/transactions/{ids[3]}/", {"accepted": True})[0] == 200
+    page = get(client, f"{url}&after={page['next_cursor']}")
+    assert [t["id"] for t in page["transactions"]] == ids[2::-1]
+    assert page["next_cursor"] == ids[0]
+    assert get(client, f"{url}&after={ids[0]}") == {
+        "transactions": [],
+        "next_cursor": None,
+    }
+
+
+def test_user_embeds_first_page_of_transactions(client):
+    """
+    A user is returned with the first page of their transactions and the
+    cursor of the rest
+    """
+    alice, bob = get_ids()
+    ids = add_requests(alice, bob, 25)
+
+    user = get(client, f"/api/users/{alice}/")
+    assert [t["id"] for t in user["transactions"]] == ids[:4:-1]
+    assert user["transactions_next_cursor"] == ids[5]
+
+    page = get(
+        client,
+        f"/api/users/{alice}/transactions/?after={user['transactions_next_cursor']}",
+    )
+    assert [t["id"] for t in page["transactions"]] == ids[4::-1]
+    assert page["next_cursor"] is None
+
+
+def count_notifications():
+    """
+    Returns the number of queued emails
+    """
+    return DB.conn.execute("SELECT COUNT(*) FROM notification;").fetchone()[0]
+
+
+def test_payment_queues_emails_in_its_transaction(client):
+    """
+    A payment's emails are queued with it, a rejected payment queues none, and
+    a payment whose emails can't be queued doesn't move money
+    """
+    alice, bob = get_ids()
+    body = {"sender_id": alice, "receiver_id": bob, "message": "hi", "accepted": True}
+    assert post(client, "/api/transactions/", {**body, "amount": 50})[0] == 403
+    assert count_notifications() == 0
+
+    assert post(client, "/api/transactions/", {**body, "amount": 4})[0] == 201
+    assert count_notifications() == 2
+
+    def broken_emails(amount, sender, receiver):
+        raise RuntimeError("template error")
+
+    with pytest.raises(RuntimeError):
+        DB.insert_sent_transaction("now", alice, bob, 1, "hi", broken_emails)
+    assert DB.get_simple_user_by_id(alice)["balance"] == 6
+    assert len(DB.get_transactions_by_user(alice)) == 1
@@ -0,0 +1,120 @@
+"""
+Tests for the notification worker, run with pytest from this directory
+"""
+
+import threading
+
+import notifications
+import pytest
+from notifications import BACKOFF_BASE, MAX_ATTEMPTS, NotificationWorker
+
+
+class StubSender:
+    """
+    Records the emails it is asked to send instead of sending them
+    """
+
+    def __init__(self, failures=0):
+        """
+        Initializes a sender that fails its first failures sends
+        """
+        self.failures = failures
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, email, subject, content):
+        """
+        Records the email and returns whether it was sent
+        """
+        with self.lock:
+            self.sent.append(content)
+            if self.failures:
+                self.failures -= 1
+                return False
+            return True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Returns a list holding the time seen by the worker, which tests move
+    """
+    now = [1000.0]
+    monkeypatch.setattr(notifications.time, "time", lambda: now[0])
+    return now
+
+
+def queue(database, count):
+    """
+    Queues count emails
+    """
+    for i in range(count):
+        database.insert_notification("alice@example.com", "Hi", f"email {i}")
+
+
+def test_worker_drains_the_outbox(database):
+    """
+    Every queued email is sent once, over as many batches as it takes
+    """
+    queue(database, notifications.BATCH_SIZE * 2 + 5)
+    sender = StubSender()
+    worker = NotificationWorker(database, sender)
+    while worker.send_batch():
+        pass
+    assert sorted(sender.sent) == sorted(
+        f"email {i}" for i in range(notifications.BATCH_SIZE * 2 + 5)
+    )
+    assert database.claim_due_notifications(float("inf"), 10, 0) == []
+
+
+def test_concurrent_workers_send_each_email_once(database):
+    """
+    Workers sharing one outbox claim emails, so none is sent twice
+    """
+    queue(database, 200)
+    sender = StubSender()
+    workers = [NotificationWorker(database, sender) for _ in range(4)]
+
+    def drain(worker):
+        while worker.send_batch():
+            pass
+
+    threads = [threading.Thread(target=drain, args=(w,)) for w in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(sender.sent) == sorted(f"email {i}" for i in range(200))
+
+
+def test_failed_email_is_retried_with_backoff(database, clock):
+    """
+    A failed email waits BACKOFF_BASE ** attempts seconds before its retry
+    """
+    queue(database, 1)
+    sender = StubSender(failures=2)
+    worker = NotificationWorker(database, sender)
+
+    for attempt in [1, 2]:
+        assert worker.send_batch() == 1
+        clock[0] += BACKOFF_BASE**attempt - 0.5
+        assert worker.send_batch() == 0
+        clock[0] += 0.5
+
+    assert worker.send_batch() == 1
+    assert sender.sent == ["email 0"] * 3
+    assert database.claim_due_notifications(float("inf"), 10, 0) == []
+
+
+def test_worker_gives_up_after_max_attempts(database, clock):
+    """
+    An email that keeps failing is dropped after MAX_ATTEMPTS sends
+    """
+    queue(database, 1)
+    sender = StubSender(failures=MAX_ATTEMPTS + 1)
+    worker = NotificationWorker(database, sender)
+    for _ in range(MAX_ATTEMPTS + 1):
+        worker.send_batch()
+        clock[0] += BACKOFF_BASE**MAX_ATTEMPTS
+    assert len(sender.sent) == MAX_ATTEMPTS
+    assert database.claim_due_notifications(float("inf"), 10, 0) == []
@@ -1,5 +1,4 @@
-import json
-
+import serialization
 from db import Assignment, Course, Submission, User, db
 from flask import Flask, request
 
@@ -20,11 +19,11 @@ with app.app_context():
 
 # generalized response formats
 def success_response(data, code=200):
-    return json.dumps(data), code
+    return serialization.dumps(data), code
 
 
 def failure_response(message, code=404):
-    return json.dumps({"error": message}), code
+    return serialization.dumps({"error": message}), code
 
 
 # helper for writing error messages
@@ -55,7 +54,7 @@ def create_course():
     """
     Endpoint for creating a new course
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     code = body.get("code")
     name = body.get("name")
 
@@ -105,7 +104,7 @@ def create_user():
     """
     Endpoint for creating a user
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     name = body.get("name")
     netid = body.get("netid")
 
@@ -143,7 +142,7 @@ def add_user_to_course(course_id):
     if course is None:
         return failure_response("Course not found!")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     user_id = body.get("user_id")
     user_type = body.get("type")
 
@@ -182,7 +181,7 @@ def create_assignment(course_id):
     if course is None:
         return failure_response("Course not found!")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     title = body.get("title")
     due_date = body.get("due_date")
 
@@ -211,7 +210,7 @@ def drop_student(course_id):
     if course is None:
         return failure_response("Course not found")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     user_id = body.get("user_id")
     if user_id is None:
         return failure_response(create_message(["User_id"]), 400)
@@ -233,7 +232,7 @@ def update_assignment(assignment_id):
     """
     Endpoint for updating an assignment by id
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     title = body.get("title")
     due_date = body.get("due_date")
 
@@ -297,7 +296,7 @@ def grade_assignment(assignment_id):
     if assignment is None:
         return failure_response("Assignment not found")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     submission_id = body.get("submission_id")
     score = body.get("score")
     fields = []
@@ -1,7 +1,7 @@
 import os
 
-import boto3
 from flask_sqlalchemy import SQLAlchemy
+from storage import get_s3_client
 
 db = SQLAlchemy()
 
@@ -187,7 +187,7 @@ class Submission(db.Model):
         """
         try:
             filename = content[content.rfind("\\") + 1 :]
-            s3 = boto3.client("s3")
+            s3 = get_s3_client()
             s3.upload_file(
                 content, S3_BUCKET_NAME, filename, ExtraArgs={"ACL": "public-read"}
             )
@@ -1,10 +1,26 @@
-import json
-
-from db import Assignment, Course, Submission, User, db
-from flask import Flask, request
+import os
+
+import serialization
+from db import (
+    Assignment,
+    Course,
+    Submission,
+    User,
+    db,
+    instructor_courses,
+    paginate,
+    serialize_query,
+    student_courses,
+)
+from flask import Flask, Response, request, stream_with_context
 
 # define db filename
-db_filename = "cms.db"
+db_filename = os.environ.get("DB_FILENAME", "cms.db")
+# page sizes for list endpoints
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# number of rows fetched from the database at a time when streaming
+STREAM_BATCH_SIZE = 500
 app = Flask(__name__)
 
 # setup config
@@ -20,11 +36,51 @@ with app.app_context():
 
 # generalized response formats
 def success_response(data, code=200):
-    return json.dumps(data), code
+    return serialization.dumps(data), code
 
 
 def failure_response(message, code=404):
-    return json.dumps({"error": message}), code
+    return serialization.dumps({"error": message}), code
+
+
+def stream_response(key, query, serializer):
+    """
+    Streams a JSON object holding the serialized rows of the given query under
+    key, fetching rows in batches so the full result is never held in memory
+    """
+
+    def generate():
+        yield f'{{"{key}": ['.encode("utf8")
+        for i, row in enumerate(query.yield_per(STREAM_BATCH_SIZE)):
+            yield (b"," if i else b"") + serialization.dumps(serializer(row))
+        yield b"]}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+# helpers for paginated list endpoints
+def get_page_args():
+    """
+    Returns the limit and after (cursor) query params of a list request
+    """
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    after = request.args.get("after", type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE)), after
+
+
+def get_next_cursor(items, limit):
+    """
+    Returns the cursor of the page after the given page of serialized items,
+    which is None if this is the last page
+    """
+    return items[-1]["id"] if len(items) == limit else None
+
+
+def page_response(key, items, limit):
+    """
+    Returns a page of serialized items along with the cursor of the next page
+    """
+    return success_response({key: items, "next_cursor": get_next_cursor(items, limit)})
 
 
 # helper for writing error messages
@@ -48,10 +104,24 @@ def hello_world():
 @app.route("/api/courses/")
 def get_courses():
     """
-    Endpoint for getting all courses
+    Endpoint for getting all courses, paginated by the limit and after
+    query params
+
+    Courses are listed without their assignments, instructors and students,
+    which are paginated by the course's own endpoints
     """
-    courses = [c.serialize() for c in Course.query.all()]
-    return success_response({"courses": courses})
+    limit, after = get_page_args()
+    courses = paginate(Course.query, Course.id, limit, after)
+    return page_response("courses", [c.simple_serialize() for c in courses], limit)
+
+
+@app.route("/api/courses/export/")
+def export_courses():
+    """
+    Endpoint for streaming every course at once
+    """
+    query = serialize_query(Course).order_by(Course.id)
+    return stream_response("courses", query, Course.serialize)
 
 
 @app.route("/api/courses/", methods=["POST"])
@@ -59,7 +129,7 @@ def create_course():
     """
     Endpoint for creating a new course
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     code = body.get("code")
     name = body.get("name")
 
@@ -85,7 +155,92 @@ def get_course(course_id):
     course = Course.query.filter_by(id=course_id).first()
     if course is None:
         return failure_response("Course not found!")
-    return success_response(course.serialize())
+    return success_response(serialize_course(course))
+
+
+@app.route("/api/courses/<int:course_id>/assignments/")
+def get_course_assignments(course_id):
+    """
+    Endpoint for getting the assignments of a course by id, paginated by the
+    limit and after query params
+    """
+    course = Course.query.filter_by(id=course_id).first()
+    if course is None:
+        return failure_response("Course not found!")
+    limit, after = get_page_args()
+    assignments = get_course_assignments_page(course_id, limit, after)
+    return page_response("assignments", assignments, limit)
+
+
+@app.route("/api/courses/<int:course_id>/instructors/")
+def get_course_instructors(course_id):
+    """
+    Endpoint for getting the instructors of a course by id, paginated by the
+    limit and after query params
+    """
+    return get_course_users(course_id, instructor_courses, "instructors")
+
+
+@app.route("/api/courses/<int:course_id>/students/")
+def get_course_students(course_id):
+    """
+    Endpoint for getting the students of a course by id, paginated by the
+    limit and after query params
+    """
+    return get_course_users(course_id, student_courses, "students")
+
+
+def get_course_users(course_id, association, key):
+    """
+    Returns a page of the users linked to a course through the given
+    association table
+    """
+    course = Course.query.filter_by(id=course_id).first()
+    if course is None:
+        return failure_response("Course not found!")
+    limit, after = get_page_args()
+    users = get_course_users_page(course_id, association, limit, after)
+    return page_response(key, users, limit)
+
+
+def get_course_assignments_page(course_id, limit, after=None):
+    """
+    Returns a page of the serialized assignments of a course
+    """
+    query = Assignment.query.filter_by(course_id=course_id)
+    return [a.simple_serialize() for a in paginate(query, Assignment.id, limit, after)]
+
+
+def get_course_users_page(course_id, association, limit, after=None):
+    """
+    Returns a page of the serialized users linked to a course through the
+    given association table
+    """
+    query = User.query.join(association, association.c.user_id == User.id).filter(
+        association.c.course_id == course_id
+    )
+    return [u.simple_serialize() for u in paginate(query, User.id, limit, after)]
+
+
+def serialize_course(course):
+    """
+    Serializes a course with the first page of its assignments, instructors
+    and students, and the cursor of each one's next page
+    """
+    data = course.simple_serialize()
+    pages = {
+        "assignments": get_course_assignments_page(course.id, DEFAULT_PAGE_SIZE),
+        "instructors": get_course_users_page(
+            course.id, instructor_courses, DEFAULT_PAGE_SIZE
+        ),
+        "students": get_course_users_page(
+            course.id, student_courses, DEFAULT_PAGE_SIZE
+        ),
+    }
+    for key, items in pages.items():
+        data[key] = items
+        data[f"{key}_next_cursor"] = get_next_cursor(items, DEFAULT_PAGE_SIZE)
+    return data
 
 
 @app.route("/api/courses/<int:course_id>/", methods=["DELETE"])
@@ -96,9 +251,10 @@ def delete_course(course_id):
     course = Course.query.filter_by(id=course_id).first()
     if course is None:
         return failure_response("Course not found!")
+    data = serialize_course(course)
     db.session.delete(course)
     db.session.commit()
-    return success_response(course.serialize())
+    return success_response(data)
 
 
 # -- USER ROUTES ------------------------------------------------------
@@ -109,7 +265,7 @@ def create_user():
     """
     Endpoint for creating a user
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     name = body.get("name")
     netid = body.get("netid")
 
@@ -132,7 +288,7 @@ def get_user(user_id):
     """
     Endpoint for getting a user by id
     """
-    user = User.query.filter_by(id=user_id).first()
+    user = serialize_query(User).filter_by(id=user_id).first()
     if user is None:
         return failure_response("User not found!")
     return success_response(user.serialize())
@@ -147,7 +303,7 @@ def add_user_to_course(course_id):
     if course is None:
         return failure_response("Course not found!")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     user_id = body.get("user_id")
     user_type = body.get("type")
 
@@ -171,7 +327,7 @@ def add_user_to_course(course_id):
         return failure_response("Type must be either 'student' or 'instructor'.", 400)
 
     db.session.commit()
-    return success_response(course.serialize())
+    return success_response(serialize_course(course))
 
 
 # -- ASSIGNMENT ROUTES ------------------------------------------------
@@ -186,7 +342,7 @@ def create_assignment(course_id):
     if course is None:
         return failure_response("Course not found!")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     title = body.get("title")
     due_date = body.get("due_date")
 
@@ -215,7 +371,7 @@ def drop_student(course_id):
     if course is None:
         return failure_response("Course not found")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     user_id = body.get("user_id")
     if user_id is None:
         return failure_response(create_message(["User_id"]), 400)
@@ -237,7 +393,7 @@ def update_assignment(assignment_id):
     """
     Endpoint for updating an assignment by id
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     title = body.get("title")
     due_date = body.get("due_date")
 
@@ -266,7 +422,7 @@ def submit_assignment(assignment_id):
     if assignment is None:
         return failure_response("Assignment not found")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     user_id = body.get("user_id")
     content = body.get("content")
     fields = []
@@ -301,7 +457,7 @@ def grade_assignment(assignment_id):
     if assignment is None:
         return failure_response("Assignment not found")
 
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     submission_id = body.get("submission_id")
     score = body.get("score")
     fields = []
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload, selectinload
 
 db = SQLAlchemy()
 
@@ -191,3 +192,37 @@ class Submission(db.Model):
         Serialize a Submission object without assignment or user field
         """
         return {"id": self.id, "score": self.score, "content": self.content}
+
+
+# eager loading strategies for each model's serialize method, so that
+# serializing many rows runs a constant number of queries instead of one
+# query per row for every relationship
+# (collections use selectin loading, single objects use joined loading)
+SERIALIZE_LOADERS = {
+    Course: [
+        selectinload(Course.assignments),
+        selectinload(Course.instructors),
+        selectinload(Course.students),
+    ],
+    Assignment: [joinedload(Assignment.course)],
+    User: [selectinload(User.courses)],
+    Submission: [joinedload(Submission.user), joinedload(Submission.assignment)],
+}
+
+
+def serialize_query(model):
+    """
+    Returns a query for the given model that eagerly loads every relationship
+    used by its serialize method
+    """
+    return model.query.options(*SERIALIZE_LOADERS.get(model, []))
+
+
+def paginate(query, column, limit, after=None):
+    """
+    Returns up to limit rows of the given query ordered by column, starting
+    after the row whose column value is after (keyset pagination)
+    """
+    if after is not None:
+        query = query.filter(column > after)
+    return query.order_by(column).limit(limit).all()
@@ -0,0 +1,99 @@
+"""
+Tests for the CMS app, run with pytest from this directory
+"""
+
+import json
+import os
+import tempfile
+
+os.environ["DB_FILENAME"] = os.path.join(tempfile.mkdtemp(), "test_cms.db")
+
+import pytest
+from app import app
+from db import Assignment, Course, User, db
+from sqlalchemy import event
+
+
+@pytest.fixture
+def client():
+    """
+    Returns a test client for an empty database
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app.test_client()
+
+
+def add_courses(count):
+    """
+    Adds count courses, each with an assignment, an instructor and two students
+    """
+    with app.app_context():
+        for i in range(count):
+            course = Course(code=f"CS {i}", name=f"Course {i}")
+            course.instructors.append(User(name=f"I{i}", netid=f"i{i}"))
+            course.students.extend(
+                [User(name=f"S{i}", netid=f"s{i}"), User(name=f"T{i}", netid=f"t{i}")]
+            )
+            db.session.add(course)
+            db.session.flush()
+            db.session.add(Assignment(title="PA1", due_date=0, course_id=course.id))
+        db.session.commit()
+
+
+def count_queries(client, url):
+    """
+    Returns the number of SQL statements run while serving a GET of url
+    """
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get(url)
+        # streamed responses only query as their body is read
+        response.get_data()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize("url", ["/api/courses/", "/api/courses/export/"])
+def test_course_listing_query_count_is_constant(client, url):
+    """
+    Listing courses runs the same number of queries for 2 courses as for 20
+    """
+    add_courses(2)
+    few = count_queries(client, url)
+    add_courses(18)
+    many = count_queries(client, url)
+    assert few == many
+    assert many <= 4
+
+
+def test_course_collections_are_paginated(client):
+    """
+    Courses are listed without their collections, and a course's students are
+    embedded one page at a time with a cursor to the rest
+    """
+    with app.app_context():
+        course = Course(code="CS 1998", name="Backend")
+        course.students.extend(User(name=f"S{i}", netid=f"s{i}") for i in range(25))
+        db.session.add(course)
+        db.session.commit()
+
+    listed = json.loads(client.get("/api/courses/").data)["courses"][0]
+    assert "students" not in listed
+
+    course = json.loads(client.get("/api/courses/1/").data)
+    assert len(course["students"]) == 20
+    after = course["students_next_cursor"]
+    rest = json.loads(client.get(f"/api/courses/1/students/?after={after}").data)
+    assert len(rest["students"]) == 5
+    assert rest["next_cursor"] is None
@@ -1,11 +1,27 @@
-import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from mimetypes import guess_type
 
-from db import Asset, db
+import serialization
+from db import Asset, db, decode_image, get_extension, hash_image, probe_image
 from flask import Flask, request
+from sqlalchemy.exc import IntegrityError
 
-db_filename = "images.db"
+db_filename = os.environ.get("DB_FILENAME", "images.db")
 app = Flask(__name__)
+# reject request bodies larger than this before reading them; Flask enforces
+# it for multipart forms, read_body for every other body
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.environ.get("MAX_UPLOAD_BYTES", 32 * 1024 * 1024)
+)
+
+# content types that don't name an image format, so raw uploads sent with
+# them are typed from the image header instead
+GENERIC_MIME_TYPES = {"", "application/octet-stream", "binary/octet-stream"}
+
+# worker pool that decodes and uploads images off the request thread
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("UPLOAD_WORKERS", 4)))
 
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///%s" % db_filename
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
@@ -21,14 +37,36 @@ def success_response(data, code=200):
     """
     Generalized success response function
     """
-    return json.dumps(data), code
+    return serialization.dumps(data), code
 
 
 def failure_response(message, code=404):
     """
     Generalized failure response function
     """
-    return json.dumps({"error": message}), code
+    return serialization.dumps({"error": message}), code
+
+
+def read_body():
+    """
+    Returns the request body, or None if it is larger than MAX_CONTENT_LENGTH
+
+    The declared length is checked before anything is read, and at most one
+    byte past the limit is read, so chunked bodies can't get around it
+    """
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    if request.content_length is not None and request.content_length > limit:
+        return None
+    chunks, size = [], 0
+    while size <= limit:
+        chunk = request.stream.read(limit + 1 - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    if size > limit:
+        return None
+    return b"".join(chunks)
 
 
 @app.route("/")
@@ -42,19 +80,142 @@ def hello_world():
 @app.route("/upload/", methods=["POST"])
 def upload():
     """
-    Endpoint for uploading an image to AWS given its base64 form,
-    then storing/returning the URL of that image
+    Endpoint for uploading an image to AWS given its base64 form
+
+    Returns a pending asset right away while the image is uploaded in the
+    background; poll the asset endpoint for its URL
     """
-    body = json.loads(request.data)
-    image_data = body.get("image_data")
+    body = read_body()
+    if body is None:
+        return failure_response("Upload is too large!", 413)
+    image_data = serialization.loads(body).get("image_data")
     if image_data is None:
         return failure_response("No base64 image passed in!")
 
-    # create new Asset object
-    asset = Asset(image_data=image_data)
-    db.session.add(asset)
-    db.session.commit()
-    return success_response(asset.serialize(), 201)
+    # only accept supported file extensions
+    ext = get_extension(guess_type(image_data)[0])
+    if ext is None:
+        return failure_response("Unsupported file type!", 400)
+
+    try:
+        img_data = decode_image(image_data)
+    except ValueError:
+        img_data = None
+    if not img_data:
+        return failure_response("Invalid base64 image!", 400)
+    return submit_image(img_data, ext)
+
+
+@app.route("/upload/raw/", methods=["POST"])
+def upload_raw():
+    """
+    Endpoint for uploading an image to AWS as raw bytes, sent either as the
+    request body (with the image's content type) or as the "image" file of a
+    multipart form
+
+    Returns a pending asset right away like the base64 upload endpoint
+    """
+    if request.mimetype == "multipart/form-data":
+        file = request.files.get("image")
+        if file is None:
+            return failure_response("No image file passed in!", 400)
+        mime_type, img_data = file.mimetype, file.read()
+    else:
+        # read the body straight from the stream, without form parsing
+        mime_type, img_data = request.mimetype, read_body()
+        if img_data is None:
+            return failure_response("Upload is too large!", 413)
+
+    if not img_data:
+        return failure_response("No image passed in!", 400)
+    if mime_type in GENERIC_MIME_TYPES:
+        return submit_image(img_data)
+
+    # only accept supported file extensions
+    ext = get_extension(mime_type)
+    if ext is None:
+        return failure_response("Unsupported file type!", 400)
+    return submit_image(img_data, ext)
+
+
+def submit_image(img_data, ext=None):
+    """
+    Checks that an image really is of the given extension using only its header,
+    then returns the existing asset for the image if it was uploaded before,
+    otherwise creates a pending asset and queues the image to be uploaded
+
+    Without an extension, the image is typed from its header alone
+    """
+    try:
+        real_ext, width, height = probe_image(img_data)
+    except ValueError as e:
+        return failure_response(str(e), 400)
+    if ext is None:
+        ext = real_ext
+    elif real_ext != ext:
+        return failure_response("Image does not match its file type!", 400)
+
+    content_hash = hash_image(img_data)
+
+    # reuse the asset of an earlier upload of the exact same image
+    asset = Asset.query.filter_by(content_hash=content_hash).first()
+    if asset is not None and not asset.is_retryable():
+        return success_response(asset.serialize())
+
+    if asset is None:
+        # create new pending Asset object
+        asset = Asset(
+            extension=ext, width=width, height=height, content_hash=content_hash
+        )
+        db.session.add(asset)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # the same image was uploaded concurrently
+            db.session.rollback()
+            asset = Asset.query.filter_by(content_hash=content_hash).first()
+            return success_response(asset.serialize())
+    else:
+        # retry the failed or lost upload, unless a concurrent upload of the
+        # same image already did
+        retried = Asset.query.filter_by(
+            id=asset.id, status=asset.status, queued_at=asset.queued_at
+        ).update({"extension": ext, "status": "pending", "queued_at": datetime.now()})
+        db.session.commit()
+        db.session.refresh(asset)
+        if not retried:
+            return success_response(asset.serialize())
+
+    executor.submit(process_asset, asset.id, img_data)
+    return success_response(asset.serialize(), 202)
+
+
+@app.route("/assets/<int:asset_id>/")
+def get_asset(asset_id):
+    """
+    Endpoint for polling the status and URL of an uploaded image
+    """
+    asset = Asset.query.filter_by(id=asset_id).first()
+    if asset is None:
+        return failure_response("Asset not found!")
+    return success_response(asset.serialize())
+
+
+def process_asset(asset_id, img_data):
+    """
+    Uploads the image of a pending asset on a worker thread, marking it failed
+    if its result can't be saved so a later upload retries it
+    """
+    with app.app_context():
+        asset = Asset.query.filter_by(id=asset_id).first()
+        asset.create(img_data)
+        try:
+            db.session.commit()
+        except Exception as e:
+            print(f"Error when saving image: {e}")
+            db.session.rollback()
+            Asset.query.filter_by(id=asset_id).update({"status": "failed"})
+            db.session.commit()
 
 
 if __name__ == "__main__":
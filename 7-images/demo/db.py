@@ -1,22 +1,126 @@
 import base64
 import datetime
+import hashlib
 import os
 import random
-import re
 import string
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from mimetypes import guess_extension, guess_type
 
-import boto3
+from boto3.s3.transfer import TransferConfig
 from flask_sqlalchemy import SQLAlchemy
 from PIL import Image
+from storage import get_s3_client
 
 db = SQLAlchemy()
 
 EXTENSIONS = ["png", "gif", "jpg", "jpeg"]
-BASE_DIR = os.getcwd()
+# file extension for each image format PIL can detect that we accept
+FORMAT_EXTENSIONS = {"PNG": "png", "GIF": "gif", "JPEG": "jpg"}
+# larger images are rejected before being decoded (decompression bombs)
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 50_000_000))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
 S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
 S3_BASE_URL = f"https://{S3_BUCKET_NAME}.s3.us-east-1.amazonaws.com"
+# filenames are random, so uploaded images never change and can be cached
+S3_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# images larger than this are uploaded in parallel parts
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024
+)
+# seconds after which a pending upload is assumed lost, e.g. to a restart, and
+# is retried by the next upload of the same image
+ASSET_PENDING_TIMEOUT = int(os.environ.get("ASSET_PENDING_TIMEOUT", 600))
+# longest side in pixels of each downscaled WebP variant made for an image
+VARIANT_SIZES = [
+    int(size)
+    for size in os.environ.get("IMAGE_VARIANT_SIZES", "128,512,1024").split(",")
+]
+
+variant_pool = None
+variant_pool_lock = threading.Lock()
+
+
+def get_variant_pool():
+    """
+    Returns the process pool that generates image variants, creating it on
+    first use
+    """
+    global variant_pool
+    with variant_pool_lock:
+        if variant_pool is None:
+            variant_pool = ProcessPoolExecutor(
+                max_workers=int(os.environ.get("VARIANT_WORKERS", os.cpu_count()))
+            )
+    return variant_pool
+
+
+def make_variants(img_data, sizes):
+    """
+    Decodes an image once and returns a (size, WebP bytes, width, height) tuple
+    for each size, from largest to smallest
+
+    Runs in the variant process pool, since resizing is CPU bound
+    """
+    img = Image.open(BytesIO(img_data))
+    img = img.convert(
+        "RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB"
+    )
+    variants = []
+    for size in sorted(sizes, reverse=True):
+        # downscale the previous variant rather than the full original
+        img.thumbnail((size, size))
+        output = BytesIO()
+        img.save(output, "WEBP")
+        variants.append((size, output.getvalue(), img.width, img.height))
+    return variants
+
+
+def decode_image(image_data):
+    """
+    Returns the bytes of an image in base64 form
+    """
+    # remove header of base64 string without scanning or copying the rest
+    if image_data.startswith("data:"):
+        image_data = image_data[image_data.index(",", 0, 256) + 1 :]
+    return base64.b64decode(image_data)
+
+
+def hash_image(img_data):
+    """
+    Returns the hash of an image's bytes, which identifies identical uploads
+    """
+    return hashlib.sha256(img_data).hexdigest()
+
+
+def probe_image(img_data):
+    """
+    Reads only the header of an image, without decoding its pixels, and returns
+    its (extension, width, height)
+
+    Raises a ValueError if the image is not a supported format or is too large
+    """
+    try:
+        with Image.open(BytesIO(img_data), formats=list(FORMAT_EXTENSIONS)) as img:
+            ext, width, height = FORMAT_EXTENSIONS[img.format], img.width, img.height
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError):
+        raise ValueError("Unsupported or invalid image!")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError("Image is too large!")
+    return ext, width, height
+
+
+def get_extension(mime_type):
+    """
+    Returns the file extension for an image mime type, or None if it is not a
+    supported filetype
+    """
+    ext = guess_extension(mime_type) if mime_type else None
+    if ext is None or ext[1:] not in EXTENSIONS:
+        return None
+    return "jpg" if ext == ".jpeg" else ext[1:]
 
 
 class Asset(db.Model):
@@ -25,85 +129,149 @@ class Asset(db.Model):
     """
 
     __tablename__ = "assets"
-    id = db.Column(db.Integer, primary_kay=True, autoincrement=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     base_url = db.Column(db.String, nullable=True)
     salt = db.Column(db.String, nullable=False)
     extension = db.Column(db.String, nullable=False)
-    width = db.Column(db.Integer, nullable=False)
-    height = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String, nullable=False)
+    content_hash = db.Column(db.String, nullable=False, unique=True)
     created_at = db.Column(db.DateTime, nullable=False)
+    # when the image was last queued for upload
+    queued_at = db.Column(db.DateTime, nullable=False)
+    variants = db.relationship("AssetVariant", cascade="delete", back_populates="asset")
 
     def __init__(self, **kwargs):
         """
-        Initializes an Asset object
+        Initializes a pending Asset object for an image with the given extension
+        and size, generating a random string for the image filename
+        """
+        # secure way of generating a random string for image filename
+        self.salt = "".join(
+            random.SystemRandom().choice(string.ascii_uppercase + string.digits)
+            for _ in range(16)
+        )
+        self.base_url = S3_BASE_URL
+        self.extension = kwargs.get("extension")
+        self.width = kwargs.get("width")
+        self.height = kwargs.get("height")
+        self.content_hash = kwargs.get("content_hash")
+        self.status = "pending"
+        self.created_at = datetime.datetime.now()
+        self.queued_at = self.created_at
+
+    def is_retryable(self):
+        """
+        Returns whether the upload of this asset should be tried again, i.e.
+        it failed, or it has been pending so long its worker must have died
         """
-        self.create(kwargs.get("image_data"))
+        if self.status == "failed":
+            return True
+        stale = datetime.datetime.now() - datetime.timedelta(
+            seconds=ASSET_PENDING_TIMEOUT
+        )
+        return self.status == "pending" and self.queued_at < stale
 
     def serialize(self):
         """
         Serializes an Asset object
         """
         return {
-            "url": f"{self.base_url}/{self.salt}.{self.extension}",
-            "created_at": str(self.created_at),
+            "id": self.id,
+            "status": self.status,
+            "url": f"{self.base_url}/{self.salt}.{self.extension}"
+            if self.status == "done"
+            else None,
+            "width": self.width,
+            "height": self.height,
+            "variants": [v.serialize() for v in self.variants],
+            "created_at": self.created_at,
         }
 
-    def create(self, image_data):
+    def create(self, img_data):
         """
-        Given an image in base64 form, does the following:
-        1. Rejects the image if it is not a supported filetype
-        2. Generates a random string for the image filename
-        3. Decodes the image and attempts to upload it to AWS
+        Given the decoded image of a pending asset, attempts to upload it to AWS,
+        marking the asset as done or failed
         """
         try:
-            ext = guess_extension(guess_type(image_data)[0])[1:]
-
-            # only accept supported file extensions
-            if ext not in EXTENSIONS:
-                raise Exception(f"Unsupported file type: {ext}")
-
-            # secure way of generating a random string for image filename
-            salt = "".join(
-                random.SystemRandom().choice(string.ascii_uppercase + string.digits)
-                for _ in range(16)
-            )
-
-            # remove header of base64 string
-            img_str = re.sub("^data:image/.+;base64,", "", image_data)
-            img_data = base64.b64decode(img_str)
-            img = Image.open(BytesIO(img_data))
-
-            self.base_url = S3_BASE_URL
-            self.salt = salt
-            self.extension = ext
-            self.width = img.width
-            self.height = img.height
-            self.created_at = datetime.datetime.now()
+            # drop the variants of an earlier failed attempt
+            AssetVariant.query.filter_by(asset_id=self.id).delete()
 
             img_filename = f"{self.salt}.{self.extension}"
-            self.upload(img, img_filename)
+            self.upload(img_data, img_filename, guess_type(img_filename)[0])
+
+            # only make variants that are smaller than the original
+            sizes = [s for s in VARIANT_SIZES if s < max(self.width, self.height)]
+            variants = []
+            if sizes:
+                images = get_variant_pool().submit(make_variants, img_data, sizes)
+                for size, data, width, height in images.result():
+                    variant = AssetVariant(
+                        asset_id=self.id, size=size, width=width, height=height
+                    )
+                    self.upload(data, variant.filename(self), "image/webp")
+                    variants.append(variant)
+            # variants are only recorded once every upload has succeeded
+            db.session.add_all(variants)
+            self.status = "done"
         except Exception as e:
             print(f"Error when creating image: {e}")
+            self.status = "failed"
 
-    def upload(self, img, img_filename):
+    def upload(self, img_data, img_filename, content_type):
         """
-        Attempts to upload the image to the specified S3 bucket
+        Uploads the image bytes to the specified S3 bucket straight from memory,
+        making it public and cacheable in the same request
         """
-        try:
-            # save image temporarily on server
-            img_temploc = f"{BASE_DIR}/{img_filename}"
-            img.save(img_temploc)
+        # upload the image to S3, without re-encoding or saving it to disk
+        get_s3_client().upload_fileobj(
+            BytesIO(img_data),
+            S3_BUCKET_NAME,
+            img_filename,
+            ExtraArgs={
+                "ACL": "public-read",
+                "ContentType": content_type,
+                "CacheControl": S3_CACHE_CONTROL,
+            },
+            Config=S3_TRANSFER_CONFIG,
+        )
 
-            # upload the image to S3
-            s3_client = boto3.client("s3")
-            s3_client.upload_file(img_temploc, S3_BUCKET_NAME, img_filename)
 
-            # make S3 image url is public
-            s3_resource = boto3.resource("s3")
-            object_acl = s3_resource.ObjectAcl(S3_BUCKET_NAME, img_filename)
-            object_acl.put(ACL="public-read")
+class AssetVariant(db.Model):
+    """
+    Asset variant model, a downscaled WebP copy of an asset's image
+    """
 
-            # remove image from server
-            os.remove(img_temploc)
-        except Exception as e:
-            print(f"Error when uploading image: {e}")
+    __tablename__ = "asset_variants"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    asset_id = db.Column(db.Integer, db.ForeignKey("assets.id"), nullable=False)
+    asset = db.relationship("Asset", back_populates="variants")
+    size = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, **kwargs):
+        """
+        Initializes an AssetVariant object
+        """
+        self.asset_id = kwargs.get("asset_id")
+        self.size = kwargs.get("size")
+        self.width = kwargs.get("width")
+        self.height = kwargs.get("height")
+
+    def filename(self, asset):
+        """
+        Returns the filename of this variant of the given asset
+        """
+        return f"{asset.salt}_{self.size}.webp"
+
+    def serialize(self):
+        """
+        Serializes an AssetVariant object
+        """
+        return {
+            "url": f"{self.asset.base_url}/{self.filename(self.asset)}",
+            "width": self.width,
+            "height": self.height,
+        }
@@ -0,0 +1,38 @@
+"""
+Storage file
+
+Helper file holding the S3 client shared by every model that touches S3.
+The client is created once per process on first use; boto3 clients are
+thread-safe, so all request and worker threads reuse its connection pool.
+"""
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# set S3_ENDPOINT_URL to point at a local S3 stand-in (e.g. moto or minio)
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_CONFIG = Config(
+    max_pool_connections=int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 20)),
+    retries={"max_attempts": 3, "mode": "standard"},
+    tcp_keepalive=True,
+)
+
+_s3_client = None
+_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Returns the process's S3 client, creating it on first use
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _lock:
+            if _s3_client is None:
+                _s3_client = boto3.session.Session().client(
+                    "s3", endpoint_url=S3_ENDPOINT_URL, config=S3_CONFIG
+                )
+    return _s3_client
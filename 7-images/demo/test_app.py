@@ -0,0 +1,244 @@
+"""
+Tests for the image upload app against a moto S3 bucket, run with pytest from
+this directory
+"""
+
+import base64
+import datetime
+import io
+import json
+import os
+import tempfile
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+os.environ["DB_FILENAME"] = os.path.join(tempfile.mkdtemp(), "test_images.db")
+os.environ["S3_BUCKET_NAME"] = "test-bucket"
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import storage
+from app import app
+from db import Asset, AssetVariant, db
+from PIL import Image
+
+
+@pytest.fixture
+def client():
+    """
+    Returns a test client for an empty database and an empty S3 bucket
+    """
+    with moto.mock_aws():
+        storage._s3_client = None
+        storage.get_s3_client().create_bucket(Bucket="test-bucket")
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        yield app.test_client()
+        storage._s3_client = None
+
+
+def make_png(size=16):
+    """
+    Returns the bytes of a size x size PNG image
+    """
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class CountingStream(io.BytesIO):
+    """
+    Request body that records how many bytes were read from it
+    """
+
+    def read(self, size=-1):
+        """
+        Reads from the body, counting the bytes read
+        """
+        data = super().read(size)
+        self.bytes_read = getattr(self, "bytes_read", 0) + len(data)
+        return data
+
+
+@pytest.fixture
+def small_limit(monkeypatch):
+    """
+    Lowers the upload size limit to 1000 bytes
+    """
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 1000)
+    return 1000
+
+
+def test_oversized_raw_body_is_rejected_unread(client, small_limit):
+    """
+    A raw body declared larger than the limit gets a 413 without being read
+    """
+    body = CountingStream(b"\x89PNG" + b"\0" * 5000)
+    response = client.post(
+        "/upload/raw/",
+        input_stream=body,
+        content_length=5004,
+        content_type="image/png",
+    )
+    assert response.status_code == 413
+    assert getattr(body, "bytes_read", 0) == 0
+
+
+def test_oversized_chunked_body_is_cut_off(client, small_limit):
+    """
+    A chunked body is read only up to just past the limit before a 413
+    """
+    body = CountingStream(b"\x89PNG" + b"\0" * 5000)
+    response = client.post(
+        "/upload/raw/",
+        input_stream=body,
+        content_type="image/png",
+        headers={"Transfer-Encoding": "chunked"},
+        environ_overrides={"wsgi.input_terminated": True},
+    )
+    assert response.status_code == 413
+    assert body.bytes_read <= small_limit + 1
+
+
+def test_oversized_base64_body_is_rejected(client, small_limit):
+    """
+    A base64 upload larger than the limit gets a 413
+    """
+    image_data = "data:image/png;base64," + "A" * 5000
+    response = client.post("/upload/", data=json.dumps({"image_data": image_data}))
+    assert response.status_code == 413
+
+
+class InlineExecutor:
+    """
+    Executor that runs each job as soon as it is submitted
+    """
+
+    def submit(self, fn, *args):
+        """
+        Runs fn with args on the calling thread
+        """
+        fn(*args)
+
+
+class LostExecutor:
+    """
+    Executor that drops every job, like a worker killed by a restart
+    """
+
+    def submit(self, fn, *args):
+        """
+        Does nothing
+        """
+
+
+@pytest.fixture
+def inline_uploads(monkeypatch):
+    """
+    Processes uploaded images before the upload request returns
+    """
+    monkeypatch.setattr("app.executor", InlineExecutor())
+
+
+def upload_png(client, img_data):
+    """
+    Uploads the image as a raw PNG body, returning the status code and asset
+    """
+    response = client.post("/upload/raw/", data=img_data, content_type="image/png")
+    return response.status_code, json.loads(response.data)
+
+
+def get_status(client, asset_id):
+    """
+    Returns the status of the asset with the given id
+    """
+    return json.loads(client.get(f"/assets/{asset_id}/").data)["status"]
+
+
+def test_same_image_is_uploaded_once(client, inline_uploads):
+    """
+    Uploading the exact same image again returns the first upload's asset
+    """
+    code, first = upload_png(client, make_png())
+    assert code == 202
+    code, second = upload_png(client, make_png())
+    assert code == 200
+    assert second["id"] == first["id"]
+    assert second["status"] == "done"
+    with app.app_context():
+        assert Asset.query.count() == 1
+
+
+def test_failed_upload_is_retried(client, inline_uploads, monkeypatch):
+    """
+    Uploading an image whose first upload failed uploads it again
+    """
+    real_upload = Asset.upload
+
+    def failing_upload(*args):
+        raise RuntimeError("S3 is down")
+
+    monkeypatch.setattr(Asset, "upload", failing_upload)
+    code, first = upload_png(client, make_png())
+    assert code == 202
+    assert get_status(client, first["id"]) == "failed"
+
+    monkeypatch.setattr(Asset, "upload", real_upload)
+    code, second = upload_png(client, make_png())
+    assert code == 202
+    assert second["id"] == first["id"]
+    assert get_status(client, first["id"]) == "done"
+
+
+def test_stale_pending_upload_is_retried(client, inline_uploads, monkeypatch):
+    """
+    An upload left pending past the timeout, e.g. by a restart, is retried,
+    while a recent pending upload is not
+    """
+    monkeypatch.setattr("app.executor", LostExecutor())
+    code, first = upload_png(client, make_png())
+    assert code == 202
+    monkeypatch.setattr("app.executor", InlineExecutor())
+
+    code, second = upload_png(client, make_png())
+    assert code == 200
+    assert second["status"] == "pending"
+
+    with app.app_context():
+        asset = Asset.query.filter_by(id=first["id"]).first()
+        asset.queued_at -= datetime.timedelta(hours=1)
+        db.session.commit()
+    code, third = upload_png(client, make_png())
+    assert code == 202
+    assert third["id"] == first["id"]
+    assert get_status(client, first["id"]) == "done"
+
+
+def test_unsaved_upload_is_marked_failed(client, inline_uploads, monkeypatch):
+    """
+    An asset whose processed result can't be committed is marked failed, so a
+    later upload retries it instead of finding it pending
+    """
+
+    def broken_create(self, img_data):
+        self.extension = None
+
+    monkeypatch.setattr(Asset, "create", broken_create)
+    code, asset = upload_png(client, make_png())
+    assert code == 202
+    assert get_status(client, asset["id"]) == "failed"
+
+
+def test_mismatched_type_is_rejected(client, inline_uploads):
+    """
+    An image sent with another image type's content type gets a 400 and no
+    asset
+    """
+    response = client.post("/upload/raw/", data=make_png(), content_type="image/jpeg")
+    assert response.status_code == 400
+    with app.app_context():
+        assert Asset.query.count() == 0
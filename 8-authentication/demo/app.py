@@ -1,11 +1,15 @@
-import datetime
-import json
+import os
 
+import passwords
+import ratelimit
+import schema
+import serialization
+import sweeper
 import users_dao
 from db import db
 from flask import Flask, request
 
-db_filename = "auth.db"
+db_filename = os.environ.get("DB_FILENAME", "auth.db")
 app = Flask(__name__)
 
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///%s" % db_filename
@@ -15,6 +19,23 @@ app.config["SQLALCHEMY_ECHO"] = True
 db.init_app(app)
 with app.app_context():
     db.create_all()
+    schema.ensure_indexes()
+
+SWEEPER = sweeper.SessionSweeper(app)
+
+
+@app.before_request
+def start_sweeper():
+    """
+    Starts the session sweeper once the process serves its first request, so
+    it never runs in a reloader or preloading parent process. Each serving
+    process runs its own sweeper; their bounded deletes don't conflict.
+    """
+    SWEEPER.ensure_running()
+
+
+# throttle the endpoints that run bcrypt
+LIMITER = ratelimit.RateLimiter(app, ["/login/", "/register/"])
 
 
 # generalized response formats
@@ -22,14 +43,14 @@ def success_response(data, code=200):
     """
     Generalized success response function
     """
-    return json.dumps(data), code
+    return serialization.dumps(data), code
 
 
 def failure_response(message, code=404):
     """
     Generalized failure response function
     """
-    return json.dumps({"error": message}), code
+    return serialization.dumps({"error": message}), code
 
 
 def extract_token(request):
@@ -60,23 +81,27 @@ def register_account():
     """
     Endpoint for registering a new user
     """
-    body = json.loads(request.data)
-    first_name = body.et("first_name")
+    body = serialization.loads(request.data)
+    first_name = body.get("first_name")
     email = body.get("email")
     password = body.get("password")
 
     if first_name is None or email is None or password is None:
         return failure_response("Invaild body", 400)
 
-    created, user = users_dao.create_user(first_name, email, password)
+    try:
+        created, user = users_dao.create_user(first_name, email, password)
+    except passwords.PoolBusy:
+        return failure_response("Server busy, try again later", 503)
     if not created:
         return failure_response("User already exists")
 
+    session = users_dao.create_session(user)
     return success_response(
         {
-            "session_token": user.session_token,
-            "session_expiration": str(user.session_expiration),
-            "update_token": user.update_token,
+            "session_token": session.session_token,
+            "session_expiration": session.session_expiration,
+            "update_token": session.update_token,
         },
         201,
     )
@@ -87,24 +112,26 @@ def login():
     """
     Endpoint for logging in a user
     """
-    body = json.loads(request.data)
+    body = serialization.loads(request.data)
     email = body.get("email")
     password = body.get("password")
 
     if email is None or password is None:
         return failure_response("Invaild body", 400)
 
-    success, user = users_dao.verify_credentials(email, password)
+    try:
+        success, user = users_dao.verify_credentials(email, password)
+    except passwords.PoolBusy:
+        return failure_response("Server busy, try again later", 503)
     if not success:
         return failure_response("Invalid credentials", 401)
 
-    user.renew_session()
-    db.session.commit()
+    session = users_dao.create_session(user)
     return success_response(
         {
-            "session_token": user.session_token,
-            "session_expiration": str(user.session_expiration),
-            "update_token": user.update_token,
+            "session_token": session.session_token,
+            "session_expiration": session.session_expiration,
+            "update_token": session.update_token,
         },
         201,
     )
@@ -121,15 +148,15 @@ def update_session():
     refresh_token = response
 
     try:
-        user = users_dao.renew_session(refresh_token)
+        session = users_dao.renew_session(refresh_token)
     except Exception:
         return failure_response("Invalid update token", 400)
 
     return success_response(
         {
-            "session_token": user.session_token,
-            "session_expiration": str(user.session_expiration),
-            "update_token": user.update_token,
+            "session_token": session.session_token,
+            "session_expiration": session.session_expiration,
+            "update_token": session.update_token,
         },
         201,
     )
@@ -147,11 +174,19 @@ def secret_message():
     if not success:
         return response
     session_token = response
-    user = users_dao.get_user_by_session_token(session_token)
-    if not user or not user.verify_session_token(session_token):
+    session = users_dao.get_session_by_session_token(session_token)
+    if not session or not session.verify_session_token(session_token):
         return failure_response("Invalid sesson token", 400)
 
-    return success_response({"message": "hello " + user.first_name})
+    return success_response({"message": "hello " + users_dao.get_first_name(session)})
+
+
+@app.route("/cache/stats/")
+def session_cache_stats():
+    """
+    Endpoint for monitoring the hit and miss counts of the session cache
+    """
+    return success_response(users_dao.session_cache.stats())
 
 
 @app.route("/logout/", methods=["POST"])
@@ -164,11 +199,10 @@ def logout():
         return response
     session_token = response
 
-    user = users_dao.get_user_by_session_token(session_token)
-    if not user or not user.verify_session_token(session_token):
+    session = users_dao.get_session_by_session_token(session_token)
+    if not session or not session.verify_session_token(session_token):
         return failure_response("Invalid session token", 400)
-    user.session_expiration = datetime.datetime.now()
-    db.session.commit()
+    users_dao.delete_session(session)
     return success_response({"message": "You have been logged out"})
 
 
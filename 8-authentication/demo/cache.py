@@ -0,0 +1,65 @@
+"""
+Cache file
+
+Helper file containing a bounded, thread-safe LRU cache whose entries expire
+after a time to live
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    LRU cache holding at most max_size entries, each for at most ttl seconds
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        Initializes an empty cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Caches value for key, evicting the least recently used entry if full
+        """
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Removes the entry for key, if any
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self):
+        """
+        Returns the hit and miss counts and current size of the cache
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
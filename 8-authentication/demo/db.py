@@ -2,8 +2,9 @@ import datetime
 import hashlib
 import os
 
-import bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from passwords import check_password, hash_password
+from tokens import SIGNED_SESSIONS, sign, verify
 
 db = SQLAlchemy()
 
@@ -21,6 +22,34 @@ class User(db.Model):
     email = db.Column(db.String, nullable=False, unique=True)
     password_digest = db.Column(db.String, nullable=False)
 
+    # Sessions, one per logged in device
+    sessions = db.relationship("Session", cascade="delete", back_populates="user")
+
+    def __init__(self, **kwargs):
+        """
+        Initializes a User object
+        """
+        self.first_name = kwargs.get("first_name")
+        self.email = kwargs.get("email")
+        self.password_digest = hash_password(kwargs.get("password"))
+
+    def verify_password(self, password):
+        """
+        Verifies the password of a user
+        """
+        return check_password(password, self.password_digest)
+
+
+class Session(db.Model):
+    """
+    Session model
+    """
+
+    __tablename__ = "session"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user = db.relationship("User", back_populates="sessions")
+
     # Session information
     session_token = db.Column(db.String, nullable=False, unique=True)
     session_expiration = db.Column(db.DateTime, nullable=False)
@@ -28,13 +57,9 @@ class User(db.Model):
 
     def __init__(self, **kwargs):
         """
-        Initializes a User object
+        Initializes a Session object
         """
-        self.first_name = kwargs.get("first_name")
-        self.email = kwargs.get("email")
-        self.password_digest = bcrypt.hashpw(
-            kwargs.get("password").encode("utf8"), bcrypt.gensalt(rounds=13)
-        )
+        self.user_id = kwargs.get("user_id")
         self.renew_session()
 
     def _urlsafe_base_64(self):
@@ -46,24 +71,30 @@ class User(db.Model):
     def renew_session(self):
         """
         Renews the sessions, i.e.
-        1. Creates a new session token
-        2. Sets the expiration time of the session to be a day from now
+        1. Sets the expiration time of the session to be a day from now
+        2. Creates a new session token, signed with the user id and expiration
+           when signed sessions are enabled
         3. Creates a new update token
         """
-        self.session_token = self._urlsafe_base_64()
         self.session_expiration = datetime.datetime.now() + datetime.timedelta(days=1)
+        if SIGNED_SESSIONS:
+            self.session_token = sign(self.user_id, self.session_expiration)
+        else:
+            self.session_token = self._urlsafe_base_64()
         self.update_token = self._urlsafe_base_64()
 
-    def verify_password(self, password):
-        """
-        Verifies the password of a user
-        """
-        return bcrypt.checkpw(password.encode("utf8"), self.password_digest)
-
     def verify_session_token(self, session_token):
         """
-        Verifies the session token of a user
+        Verifies the session token of a session
         """
+        if SIGNED_SESSIONS:
+            # the signature and expiry are checked in memory
+            parsed = verify(session_token)
+            return (
+                session_token == self.session_token
+                and parsed is not None
+                and parsed[0] == self.user_id
+            )
         return (
             session_token == self.session_token
             and datetime.datetime.now() < self.session_expiration
@@ -71,6 +102,27 @@ class User(db.Model):
 
     def verify_update_token(self, update_token):
         """
-        Verifies the update token of a user
+        Verifies the update token of a session
         """
         return update_token == self.update_token
+
+
+class RevokedToken(db.Model):
+    """
+    Revoked token model, logging signed session tokens revoked before they
+    expire so every worker process learns of them
+    """
+
+    __tablename__ = "revoked_token"
+    # workers read the log by increasing id, so ids must never be reused
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String, nullable=False)
+    expiration = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, **kwargs):
+        """
+        Initializes a RevokedToken object
+        """
+        self.token = kwargs.get("token")
+        self.expiration = kwargs.get("expiration")
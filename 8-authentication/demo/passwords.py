@@ -0,0 +1,96 @@
+"""
+Passwords file
+
+Helper file that hashes and checks passwords with bcrypt on a bounded pool of
+worker processes, so bcrypt runs off the request threads and a burst of logins
+is turned away with a 503 instead of piling up behind the pool
+
+Each app process starts its own pool, so with gunicorn the machine runs up to
+(gunicorn workers) x BCRYPT_WORKERS bcrypt processes; size BCRYPT_WORKERS for
+that total
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+# bcrypt work factor; each extra round doubles the time to hash a password
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 13))
+# leave half of the cores to the request handlers by default
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", max(1, os.cpu_count() // 2)))
+# most passwords queued or being hashed at once, and how long a request waits
+# for room in the queue before giving up
+BCRYPT_MAX_PENDING = int(os.environ.get("BCRYPT_MAX_PENDING", 4 * BCRYPT_WORKERS))
+BCRYPT_QUEUE_TIMEOUT = float(os.environ.get("BCRYPT_QUEUE_TIMEOUT", 1))
+
+pool = None
+pool_lock = threading.Lock()
+pending = threading.BoundedSemaphore(BCRYPT_MAX_PENDING)
+
+
+class PoolBusy(Exception):
+    """
+    Raised when the bcrypt queue stays full for BCRYPT_QUEUE_TIMEOUT seconds,
+    or when the pool broke under the call
+    """
+
+
+def get_pool():
+    """
+    Returns the process pool that runs bcrypt, creating it on first use
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS)
+    return pool
+
+
+def drop_pool(broken):
+    """
+    Shuts down the broken pool, if it is still the current one, so the next
+    call starts a new one
+    """
+    global pool
+    with pool_lock:
+        if pool is broken:
+            pool = None
+    broken.shutdown(wait=False)
+
+
+def run(fn, *args):
+    """
+    Runs fn on the process pool and returns its result, raising PoolBusy if
+    the queue has no room for it in time or a pool worker died under it
+    """
+    if not pending.acquire(timeout=BCRYPT_QUEUE_TIMEOUT):
+        raise PoolBusy()
+    try:
+        current = get_pool()
+        try:
+            return current.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # a worker was killed, e.g. by the OOM killer, which breaks the
+            # whole pool for good
+            drop_pool(current)
+            raise PoolBusy()
+    finally:
+        pending.release()
+
+
+def hash_password(password):
+    """
+    Returns the bcrypt digest of a password
+    """
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return run(bcrypt.hashpw, password.encode("utf8"), salt)
+
+
+def check_password(password, password_digest):
+    """
+    Returns true if the password matches the bcrypt digest, otherwise false
+    """
+    return run(bcrypt.checkpw, password.encode("utf8"), password_digest)
@@ -0,0 +1,252 @@
+"""
+Rate limit file
+
+Helper file containing a token bucket rate limiter that runs before requests
+to throttled endpoints, so abusive clients are turned away before bcrypt runs
+
+Each client IP and each email in the request body gets its own bucket. Buckets
+live in memory by default; set RATE_LIMIT_BACKEND=shared to keep them in a
+shared memory table used by every worker process on the machine (e.g. with
+gunicorn --workers=4)
+"""
+
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+import serialization
+from flask import request
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_IP_PER_MINUTE = int(os.environ.get("RATE_LIMIT_IP_PER_MINUTE", 20))
+RATE_LIMIT_EMAIL_PER_MINUTE = int(os.environ.get("RATE_LIMIT_EMAIL_PER_MINUTE", 5))
+# most buckets tracked at once; past that, older buckets are forgotten
+RATE_LIMIT_SLOTS = int(os.environ.get("RATE_LIMIT_SLOTS", 65536))
+RATE_LIMIT_SHM_NAME = os.environ.get("RATE_LIMIT_SHM_NAME", "auth_rate_limit")
+
+
+def refill(tokens, updated, now, capacity, per_second):
+    """
+    Returns the tokens in a bucket last updated at updated, topped up for the
+    time since then
+    """
+    return min(capacity, tokens + (now - updated) * per_second)
+
+
+def get_wait(levels, limits):
+    """
+    Returns the seconds until every bucket, holding the given token levels and
+    refilled at the per_second of its (key, capacity, per_second) limit, has a
+    token, which is 0 if they all have one now
+    """
+    return max(
+        0 if tokens >= 1 else (1 - tokens) / per_second
+        for tokens, (_, _, per_second) in zip(levels, limits)
+    )
+
+
+class FileLock:
+    """
+    Context manager holding an exclusive lock on an open file
+    """
+
+    def __init__(self, file):
+        """
+        Initializes a lock on file
+        """
+        self.file = file
+
+    def __enter__(self):
+        """
+        Waits for and takes the lock
+        """
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        """
+        Releases the lock
+        """
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+
+
+class MemoryBackend:
+    """
+    Token buckets held in this process, bounded to max_size buckets
+    """
+
+    def __init__(self, max_size):
+        """
+        Initializes an empty set of buckets
+        """
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, limits):
+        """
+        Takes a token from the bucket of each (key, capacity, per_second)
+        limit, but only if every one of them has a token
+
+        Returns 0 if the tokens were taken, otherwise the seconds until every
+        bucket has one
+        """
+        now = time.monotonic()
+        with self.lock:
+            levels = []
+            for key, capacity, per_second in limits:
+                tokens, updated = self.buckets.pop(key, (capacity, now))
+                levels.append(refill(tokens, updated, now, capacity, per_second))
+            wait = get_wait(levels, limits)
+            for (key, _, _), tokens in zip(limits, levels):
+                self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+            while len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class SharedMemoryBackend:
+    """
+    Token buckets held in a fixed size shared memory table, so every worker
+    process on the machine shares them
+
+    The table starts with a random secret, and each key hashes to one slot of
+    (tokens, updated) under a hash keyed by that secret, so clients can't pick
+    keys that land on each other's slots. Keys that do collide share one
+    bucket, which can only make limits stricter, never let traffic through
+    """
+
+    SECRET_SIZE = 16
+    SLOT = struct.Struct("dd")
+
+    def __init__(self, name, slots):
+        """
+        Attaches to the shared table called name, creating it if needed
+        """
+        self.slots = slots
+        self.lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self.lock = threading.Lock()
+        self.lock_file = None
+        self.pid = None
+        with self.locked():
+            try:
+                self.shm = shared_memory.SharedMemory(
+                    name, create=True, size=self.SECRET_SIZE + slots * self.SLOT.size
+                )
+                self.shm.buf[: self.SECRET_SIZE] = os.urandom(self.SECRET_SIZE)
+            except FileExistsError:
+                self.shm = shared_memory.SharedMemory(name)
+        self.secret = bytes(self.shm.buf[: self.SECRET_SIZE])
+        # the table outlives any one worker, so don't unlink it when this
+        # process exits
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    def locked(self):
+        """
+        Returns the file lock guarding the table, reopened after a fork since
+        forked processes would otherwise share one lock
+        """
+        if self.pid != os.getpid():
+            self.lock_file = open(self.lock_path, "a")
+            self.pid = os.getpid()
+        return FileLock(self.lock_file)
+
+    def get_offset(self, key):
+        """
+        Returns where the slot for key starts in the table
+        """
+        digest = hashlib.blake2b(
+            key.encode("utf8"), digest_size=8, key=self.secret
+        ).digest()
+        slot = int.from_bytes(digest, "little") % self.slots
+        return self.SECRET_SIZE + slot * self.SLOT.size
+
+    def take(self, limits):
+        """
+        Takes a token from the bucket of each (key, capacity, per_second)
+        limit, but only if every one of them has a token
+
+        Returns 0 if the tokens were taken, otherwise the seconds until every
+        bucket has one
+        """
+        offsets = [self.get_offset(key) for key, _, _ in limits]
+        now = time.time()
+        with self.lock, self.locked():
+            levels = []
+            for offset, (_, capacity, per_second) in zip(offsets, limits):
+                # an unused slot is all zeros, which refills to a full bucket
+                tokens, updated = self.SLOT.unpack_from(self.shm.buf, offset)
+                levels.append(refill(tokens, updated, now, capacity, per_second))
+            wait = get_wait(levels, limits)
+            for offset, tokens in zip(offsets, levels):
+                self.SLOT.pack_into(
+                    self.shm.buf, offset, tokens - 1 if not wait else tokens, now
+                )
+        return wait
+
+
+def get_backend():
+    """
+    Returns the bucket backend selected by RATE_LIMIT_BACKEND
+    """
+    if RATE_LIMIT_BACKEND == "shared":
+        return SharedMemoryBackend(RATE_LIMIT_SHM_NAME, RATE_LIMIT_SLOTS)
+    return MemoryBackend(RATE_LIMIT_SLOTS)
+
+
+class RateLimiter:
+    """
+    Middleware that rejects requests to the given endpoints with 429 once the
+    client IP or the email in the body runs out of tokens
+    """
+
+    def __init__(self, app, paths, backend=None):
+        """
+        Initializes a limiter for requests to paths and registers it on app
+        """
+        self.paths = set(paths)
+        self.backend = backend or get_backend()
+        app.before_request(self.check)
+
+    def check(self):
+        """
+        Returns a 429 response if the request is over its limit, otherwise None
+        so the request goes on to its endpoint
+        """
+        if request.path not in self.paths:
+            return None
+
+        limits = [(f"ip:{request.remote_addr}", RATE_LIMIT_IP_PER_MINUTE)]
+        email = self.get_email()
+        if email is not None:
+            limits.append((f"email:{email}", RATE_LIMIT_EMAIL_PER_MINUTE))
+
+        # tokens are only taken when every bucket has one, so requests turned
+        # away for their IP don't use up the budget of the email they target
+        wait = self.backend.take(
+            [
+                (f"{request.path}:{key}", per_minute, per_minute / 60)
+                for key, per_minute in limits
+            ]
+        )
+        if not wait:
+            return None
+        response = serialization.dumps({"error": "Too many requests"})
+        return response, 429, {"Retry-After": str(int(wait) + 1)}
+
+    def get_email(self):
+        """
+        Returns the normalized email in the request body, if any
+        """
+        try:
+            email = serialization.loads(request.data).get("email")
+        except Exception:
+            return None
+        if not isinstance(email, str):
+            return None
+        return email.strip().lower()
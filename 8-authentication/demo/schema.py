@@ -0,0 +1,28 @@
+"""
+Schema file
+
+Helper file declaring the named indexes of the auth tables beyond the ones
+implied by their unique constraints (email, session_token and update_token)
+"""
+
+from db import RevokedToken, Session, User, db
+
+INDEXES = [
+    # lookups of users by name
+    db.Index("user_first_name", User.first_name),
+    # listing a user's sessions
+    db.Index("session_user_id", Session.user_id),
+    # sweeps of expired sessions
+    db.Index("session_session_expiration", Session.session_expiration),
+    # sweeps of expired revoked tokens
+    db.Index("revoked_token_expiration", RevokedToken.expiration),
+]
+
+
+def ensure_indexes():
+    """
+    Creates any index that is missing, including on tables created before the
+    index was declared
+    """
+    for index in INDEXES:
+        index.create(db.engine, checkfirst=True)
@@ -0,0 +1,66 @@
+"""
+Serialization file
+
+Helper file for encoding and decoding JSON with the fastest installed backend
+(orjson, then ujson, then the standard library). The backend can be forced
+with the JSON_BACKEND environment variable.
+
+dumps always returns bytes, which Flask can send as-is, and datetimes are
+encoded as ISO 8601 strings by every backend.
+"""
+
+import datetime
+import json
+import os
+
+
+def default(obj):
+    """
+    Encodes objects that are not natively JSON serializable
+    """
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_dumps(data):
+    """
+    Encodes data with the standard library json module
+    """
+    return json.dumps(data, default=default).encode("utf8")
+
+
+BACKENDS = {"json": (json_dumps, json.loads)}
+
+try:
+    import ujson
+
+    def ujson_dumps(data):
+        """
+        Encodes data with ujson
+        """
+        return ujson.dumps(data, default=default, escape_forward_slashes=False).encode(
+            "utf8"
+        )
+
+    BACKENDS["ujson"] = (ujson_dumps, ujson.loads)
+except ImportError:
+    pass
+
+try:
+    import orjson
+
+    def orjson_dumps(data):
+        """
+        Encodes data with orjson
+        """
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    BACKENDS["orjson"] = (orjson_dumps, orjson.loads)
+except ImportError:
+    pass
+
+BACKEND = os.environ.get(
+    "JSON_BACKEND", next(b for b in ["orjson", "ujson", "json"] if b in BACKENDS)
+)
+dumps, loads = BACKENDS[BACKEND]
@@ -0,0 +1,77 @@
+"""
+Sweeper file
+
+Helper file containing a background thread that periodically deletes expired
+sessions and revoked tokens, in bounded batches so the session table and its token indexes stay
+small without holding the database lock for long
+"""
+
+import os
+import threading
+
+import users_dao
+
+SWEEP_INTERVAL = int(os.environ.get("SESSION_SWEEP_INTERVAL", 300))
+SWEEP_BATCH_SIZE = int(os.environ.get("SESSION_SWEEP_BATCH_SIZE", 1000))
+
+
+class SessionSweeper(threading.Thread):
+    """
+    Daemon thread that deletes expired sessions and revoked tokens every
+    SWEEP_INTERVAL seconds until stopped
+    """
+
+    def __init__(self, app):
+        """
+        Initializes a sweeper that runs in the app context of app
+        """
+        super().__init__(daemon=True)
+        self.app = app
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def ensure_running(self):
+        """
+        Starts the sweeper if it hasn't been started yet
+        """
+        with self.lock:
+            if not self.is_alive() and not self.stopped.is_set():
+                self.start()
+
+    def stop(self):
+        """
+        Stops the sweeper after its current batch
+        """
+        self.stopped.set()
+
+    def run(self):
+        """
+        Sweeps expired sessions and revoked tokens, then sleeps until the next
+        sweep
+        """
+        while not self.stopped.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error when sweeping sessions: {e}")
+            self.stopped.wait(SWEEP_INTERVAL)
+
+    def sweep(self):
+        """
+        Deletes expired sessions, then expired revoked tokens, SWEEP_BATCH_SIZE
+        at a time until none are left
+
+        Returns the number of rows deleted
+        """
+        total = 0
+        with self.app.app_context():
+            for delete_expired in (
+                users_dao.delete_expired_sessions,
+                users_dao.delete_expired_revoked_tokens,
+            ):
+                while not self.stopped.is_set():
+                    deleted = delete_expired(SWEEP_BATCH_SIZE)
+                    total += deleted
+                    if deleted < SWEEP_BATCH_SIZE:
+                        break
+        return total
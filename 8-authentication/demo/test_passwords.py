@@ -0,0 +1,27 @@
+"""
+Tests for the bcrypt process pool, run with pytest from this directory
+"""
+
+import os
+import signal
+
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+import passwords
+import pytest
+
+
+def test_broken_pool_is_replaced():
+    """
+    A call whose pool lost a worker fails with PoolBusy, and the next call
+    runs on a new pool
+    """
+    digest = passwords.hash_password("password")
+    broken = passwords.pool
+    for pid in list(broken._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    with pytest.raises(passwords.PoolBusy):
+        passwords.check_password("password", digest)
+    assert passwords.check_password("password", digest)
+    assert passwords.pool is not broken
@@ -0,0 +1,62 @@
+"""
+Tests for the login rate limiter, run with pytest from this directory
+"""
+
+import json
+import os
+
+import pytest
+import ratelimit
+from flask import Flask
+
+
+@pytest.fixture(params=["memory", "shared"])
+def client(request):
+    """
+    Returns a test client for an app whose /login/ endpoint is rate limited by
+    the given backend
+    """
+    if request.param == "shared":
+        backend = ratelimit.SharedMemoryBackend(f"test_rate_limit_{os.getpid()}", 1024)
+        request.addfinalizer(backend.shm.unlink)
+    else:
+        backend = ratelimit.MemoryBackend(1024)
+
+    app = Flask(__name__)
+    ratelimit.RateLimiter(app, ["/login/"], backend)
+    app.add_url_rule("/login/", "login", lambda: "", methods=["POST"])
+    return app.test_client()
+
+
+def login(client, ip, email):
+    """
+    Returns the status code of a login for email from ip
+    """
+    response = client.post(
+        "/login/",
+        data=json.dumps({"email": email}),
+        environ_base={"REMOTE_ADDR": ip},
+    )
+    return response.status_code
+
+
+def test_rejected_requests_take_no_tokens(client):
+    """
+    Requests rejected for their IP don't use up the bucket of the email they
+    name, so its owner can still log in from elsewhere
+    """
+    for i in range(ratelimit.RATE_LIMIT_IP_PER_MINUTE):
+        assert login(client, "10.0.0.1", f"user{i}@x") == 200
+    for _ in range(ratelimit.RATE_LIMIT_EMAIL_PER_MINUTE * 2):
+        assert login(client, "10.0.0.1", "victim@x") == 429
+
+    assert login(client, "10.0.0.2", "victim@x") == 200
+
+
+def test_email_limit_applies_across_ips(client):
+    """
+    An email runs out of tokens however many IPs its logins come from
+    """
+    for i in range(ratelimit.RATE_LIMIT_EMAIL_PER_MINUTE):
+        assert login(client, f"10.0.1.{i}", "victim@x") == 200
+    assert login(client, "10.0.2.1", "victim@x") == 429
@@ -0,0 +1,114 @@
+"""
+Query plan tests for the auth DAO, run with pytest from this directory
+
+Each DAO lookup must search its table through an index rather than scan it,
+so auth checks stay fast as the user and session tables grow
+"""
+
+import datetime
+import os
+import tempfile
+
+os.environ["DB_FILENAME"] = os.path.join(tempfile.mkdtemp(), "test_auth.db")
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+import pytest
+import users_dao
+from app import SWEEPER, app
+from db import db
+from sqlalchemy import event
+from sweeper import SessionSweeper
+
+# tests run sweeps themselves, on sweepers of their own
+SWEEPER.stop()
+
+
+@pytest.fixture
+def session():
+    """
+    Returns the session of a user in an otherwise empty database
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        _, user = users_dao.create_user("Alice", "alice@example.com", "password")
+        yield users_dao.create_session(user)
+
+
+def get_query_plans(call):
+    """
+    Returns the query plan of each SQL statement run by call, as the list of
+    its steps
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        call()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    plans = []
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            if statement.split()[0] not in ("SELECT", "UPDATE", "DELETE"):
+                continue
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plans.append([row[-1] for row in rows])
+    return plans
+
+
+LOOKUPS = {
+    "get_user_by_email": lambda session: users_dao.get_user_by_email(
+        "alice@example.com"
+    ),
+    "get_session_by_session_token": lambda session: (
+        users_dao.session_cache.invalidate(session.session_token),
+        users_dao.get_session_by_session_token(session.session_token),
+    ),
+    "get_session_by_update_token": lambda session: (
+        users_dao.get_session_by_update_token(session.update_token)
+    ),
+    "get_first_name": lambda session: users_dao.get_first_name(
+        users_dao.SessionRecord(session.user_id, None, None, None)
+    ),
+    "sync_revoked_tokens": lambda session: (
+        setattr(users_dao, "revocations_synced_at", None),
+        users_dao.sync_revoked_tokens(),
+    ),
+    "delete_session": lambda session: users_dao.delete_session(session),
+    "delete_expired_sessions": lambda session: users_dao.delete_expired_sessions(10),
+    "delete_expired_revoked_tokens": lambda session: (
+        users_dao.delete_expired_revoked_tokens(10)
+    ),
+}
+
+
+@pytest.mark.parametrize("name", LOOKUPS)
+def test_lookup_uses_index(session, name):
+    """
+    Tests that every statement a DAO lookup runs searches an index instead of
+    scanning a table
+    """
+    plans = get_query_plans(lambda: LOOKUPS[name](session))
+    assert plans
+    for plan in plans:
+        assert not [step for step in plan if step.startswith("SCAN")], plan
+
+
+def test_sweep_deletes_expired_sessions(session):
+    """
+    Tests that a sweep deletes expired sessions and keeps live ones
+    """
+    expired = users_dao.create_session(session.user)
+    expired.session_expiration = datetime.datetime.now() - datetime.timedelta(days=1)
+    db.session.commit()
+    expired_token, live_token = expired.update_token, session.update_token
+
+    assert SessionSweeper(app).sweep() == 1
+    db.session.expunge_all()
+    assert users_dao.get_session_by_update_token(expired_token) is None
+    assert users_dao.get_session_by_update_token(live_token) is not None
@@ -0,0 +1,90 @@
+"""
+Tokens file
+
+Helper file for signed session tokens, which carry a user id and expiration
+signed with HMAC so they can be checked in memory without a database lookup
+
+Enabled by setting SESSION_TOKEN_MODE=signed and SESSION_SECRET. Logged out
+and renewed tokens go on a revocation list kept in memory, which the DAO
+shares between worker processes through the database
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+SIGNED_SESSIONS = os.environ.get("SESSION_TOKEN_MODE") == "signed"
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "").encode("utf8")
+if SIGNED_SESSIONS and not SESSION_SECRET:
+    raise Exception("SESSION_SECRET must be set to use signed session tokens")
+
+# logged out tokens mapped to when they expire, after which they are dropped
+revoked_tokens = {}
+revoked_lock = threading.Lock()
+
+
+def _signature(payload):
+    """
+    Returns the HMAC signature of a token payload
+    """
+    return hmac.new(SESSION_SECRET, payload.encode("utf8"), hashlib.sha256).hexdigest()
+
+
+def _parse(token):
+    """
+    Returns the (user id, expiration timestamp) of a signed token if its
+    signature is valid, otherwise None
+    """
+    try:
+        payload, signature = token.rsplit(".", 1)
+        user_id, expiration, _ = payload.split(".")
+        if not hmac.compare_digest(signature, _signature(payload)):
+            return None
+        return int(user_id), int(expiration)
+    except ValueError:
+        return None
+
+
+def sign(user_id, expiration):
+    """
+    Returns a new signed session token for a user that expires at the given
+    datetime
+    """
+    # the nonce keeps tokens unique even when issued in the same second
+    payload = f"{user_id}.{int(expiration.timestamp())}.{os.urandom(8).hex()}"
+    return f"{payload}.{_signature(payload)}"
+
+
+def verify(token):
+    """
+    Returns the (user id, expiration timestamp) of a signed session token, or
+    None if the token is forged, expired or revoked
+    """
+    parsed = _parse(token)
+    if parsed is None or parsed[1] < time.time():
+        return None
+    with revoked_lock:
+        if token in revoked_tokens:
+            return None
+    return parsed
+
+
+def revoke(token):
+    """
+    Revokes a signed session token until it expires, dropping revoked tokens
+    that have expired since
+
+    Returns the expiration timestamp of the token, or None if it isn't signed
+    """
+    parsed = _parse(token)
+    if parsed is None:
+        return None
+    now = time.time()
+    with revoked_lock:
+        for revoked, expiration in list(revoked_tokens.items()):
+            if expiration < now:
+                del revoked_tokens[revoked]
+        revoked_tokens[token] = parsed[1]
+    return parsed[1]
@@ -4,7 +4,53 @@ DAO (Data Access Object) file
 Helper file containing functions for accessing data in our database
 """
 
-from db import User, db
+import datetime
+import os
+import threading
+import time
+from collections import namedtuple
+
+import tokens
+from cache import TTLCache
+from db import RevokedToken, Session, User, db
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+
+# recently used session tokens and their sessions, to skip the database on
+# authenticated requests
+#
+# The cache lives in each worker process, and logging out or renewing a
+# session only invalidates it in the process that handled that request, so
+# other workers keep accepting the old token for up to SESSION_CACHE_TTL
+# seconds. Keep the TTL short when running several workers.
+session_cache = TTLCache(
+    int(os.environ.get("SESSION_CACHE_SIZE", 10000)),
+    int(os.environ.get("SESSION_CACHE_TTL", 5)),
+)
+
+# how often each worker process reads the signed tokens revoked by the others,
+# and the last revocation it has read
+REVOCATION_SYNC_INTERVAL = float(os.environ.get("REVOCATION_SYNC_INTERVAL", 5))
+revocation_lock = threading.Lock()
+revocations_synced_at = None
+last_revoked_id = 0
+
+
+class SessionRecord(
+    namedtuple(
+        "SessionRecord",
+        ["user_id", "first_name", "session_token", "session_expiration"],
+    )
+):
+    """
+    Plain copy of a session and its user's first name, cached instead of the
+    ORM objects so it can be shared between threads and requests
+
+    Records built from signed tokens leave first_name as None until asked for
+    """
+
+    # the check only reads fields copied into the record
+    verify_session_token = Session.verify_session_token
 
 
 def get_user_by_email(email):
@@ -14,18 +60,125 @@ def get_user_by_email(email):
     return User.query.filter(User.email == email).first()
 
 
-def get_user_by_session_token(session_token):
+def get_session_by_session_token(session_token):
+    """
+    Returns a session record, with its user's first name, from the database
+    given a session token, served from the session cache when the token was
+    seen recently
+
+    Signed tokens are checked against their signature, expiration and the
+    revocation list alone, without reading the session
+    """
+    if tokens.SIGNED_SESSIONS:
+        sync_revoked_tokens()
+        parsed = tokens.verify(session_token)
+        if parsed is None:
+            return None
+        user_id, expiration = parsed
+        return SessionRecord(
+            user_id, None, session_token, datetime.datetime.fromtimestamp(expiration)
+        )
+
+    record = session_cache.get(session_token)
+    if record is not None:
+        return record
+
+    session = (
+        Session.query.options(joinedload(Session.user))
+        .filter(Session.session_token == session_token)
+        .first()
+    )
+    if session is None:
+        return None
+    record = SessionRecord(
+        session.user_id,
+        session.user.first_name,
+        session.session_token,
+        session.session_expiration,
+    )
+    session_cache.put(session_token, record)
+    return record
+
+
+def get_first_name(session):
+    """
+    Returns the first name of the user of a session record, loading it from
+    the database if the record was built from a signed token
+    """
+    if session.first_name is not None:
+        return session.first_name
+    return db.session.query(User.first_name).filter(User.id == session.user_id).scalar()
+
+
+def revoke_token(session_token):
+    """
+    Revokes a signed session token in this process, and logs the revocation
+    for the other worker processes to read when the session is committed
+    """
+    expiration = tokens.revoke(session_token)
+    if expiration is not None:
+        db.session.add(
+            RevokedToken(
+                token=session_token,
+                expiration=datetime.datetime.fromtimestamp(expiration),
+            )
+        )
+
+
+def sync_revoked_tokens():
+    """
+    Adds the signed tokens revoked by other worker processes to this process's
+    revocation list, at most once every REVOCATION_SYNC_INTERVAL seconds
+    """
+    global revocations_synced_at, last_revoked_id
+    now = time.monotonic()
+    with revocation_lock:
+        if (
+            revocations_synced_at is not None
+            and now - revocations_synced_at < REVOCATION_SYNC_INTERVAL
+        ):
+            return
+        revocations_synced_at = now
+        after = last_revoked_id
+
+    revoked = (
+        db.session.query(RevokedToken.id, RevokedToken.token)
+        .filter(RevokedToken.id > after)
+        .order_by(RevokedToken.id)
+        .all()
+    )
+    for _, token in revoked:
+        tokens.revoke(token)
+    if revoked:
+        with revocation_lock:
+            last_revoked_id = max(last_revoked_id, revoked[-1].id)
+
+
+@event.listens_for(Session.session_token, "set")
+def invalidate_session_token(session, value, old_value, initiator):
     """
-    Returns a user object from the database given a session token
+    Drops a session's old token from the session cache when it is renewed, and
+    revokes it if it was signed
     """
-    return User.query.filter(User.session_token == session_token).first()
+    if isinstance(old_value, str):
+        session_cache.invalidate(old_value)
+        revoke_token(old_value)
 
 
-def get_user_by_update_token(update_token):
+@event.listens_for(Session.session_expiration, "set")
+def invalidate_session_expiration(session, value, old_value, initiator):
     """
-    Returns a user object from the database given an update token
+    Drops a session's token from the session cache when its expiration changes
     """
-    return User.query.filter(User.update_token == update_token).first()
+    if session.session_token is not None:
+        session_cache.invalidate(session.session_token)
+
+
+def get_session_by_update_token(update_token):
+    """
+    Returns a session object from the database given an update token
+    """
+    return Session.query.filter(Session.update_token == update_token).first()
 
 
 def verify_credentials(email, password):
@@ -55,15 +208,74 @@ def create_user(first_name, email, password):
     return True, user
 
 
+def create_session(user):
+    """
+    Creates a Session object in the database for a newly logged in device
+
+    Returns the Session object
+    """
+    session = Session(user_id=user.id)
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+
 def renew_session(update_token):
     """
-    Renews a user's session token
+    Renews a session's token
 
-    Returns the User object
+    Returns the Session object
     """
-    possible_user = get_user_by_update_token(update_token)
-    if possible_user is None:
+    possible_session = get_session_by_update_token(update_token)
+    if possible_session is None:
         raise Exception("Invalid update token")
-    possible_user.renew_session()
+    possible_session.renew_session()
+    db.session.commit()
+    return possible_session
+
+
+def delete_session(session):
+    """
+    Deletes a session from the database given its record, e.g. on logout
+    """
+    session_cache.invalidate(session.session_token)
+    revoke_token(session.session_token)
+    Session.query.filter(Session.session_token == session.session_token).delete()
+    db.session.commit()
+
+
+def delete_expired_sessions(limit):
+    """
+    Deletes up to limit sessions that have expired
+
+    Returns the number of sessions deleted
+    """
+    expired = (
+        db.session.query(Session.id)
+        .filter(Session.session_expiration < datetime.datetime.now())
+        .limit(limit)
+    )
+    deleted = Session.query.filter(Session.id.in_(expired.scalar_subquery())).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return deleted
+
+
+def delete_expired_revoked_tokens(limit):
+    """
+    Deletes up to limit revoked tokens that have expired, and so no longer
+    need revoking
+
+    Returns the number of revoked tokens deleted
+    """
+    expired = (
+        db.session.query(RevokedToken.id)
+        .filter(RevokedToken.expiration < datetime.datetime.now())
+        .limit(limit)
+    )
+    deleted = RevokedToken.query.filter(
+        RevokedToken.id.in_(expired.scalar_subquery())
+    ).delete(synchronize_session=False)
     db.session.commit()
-    return possible_user
+    return deleted